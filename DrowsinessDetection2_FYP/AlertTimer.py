@@ -0,0 +1,104 @@
+# Default thresholds shared by the server, the desktop detector and the
+# offline scorer
+EYE_AR_THRESH = 0.23
+MOUTH_AR_THRESH = 0.65
+
+# How long each condition must hold before it raises an alert, in seconds
+EYE_CLOSED_SECONDS = 2
+MOUTH_OPEN_SECONDS = 5
+
+# A condition must also be seen on this many frames in a row, so a single
+# mis-landmarked frame cannot start or complete a run
+EYE_AR_CONSEC_FRAMES = 3
+
+
+class ConditionTimer:
+    """Tracks how long a per-frame condition has held, in capture time.
+
+    Timestamps come from the frames themselves (capture time, or frame
+    index / fps for recordings) rather than the clock at processing time,
+    so the result does not depend on processing lag, queueing or replay
+    speed. The timer is active once the condition has held for `duration`
+    seconds and `consec_frames` frames in a row; any frame without the
+    condition resets it. Frames older than the newest one seen are ignored.
+    """
+
+    def __init__(self, duration, consec_frames=EYE_AR_CONSEC_FRAMES):
+        self.duration = duration
+        self.consec_frames = consec_frames
+        self.counter = 0
+        self.start_time = None
+        self.last_timestamp = None
+        self.active = False
+
+    def update(self, condition, timestamp):
+        """Feed one frame; returns True on the frame where the timer fires."""
+        if self.last_timestamp is not None and timestamp < self.last_timestamp:
+            return False
+        self.last_timestamp = timestamp
+
+        if not condition:
+            self.counter = 0
+            self.start_time = None
+            self.active = False
+            return False
+
+        self.counter += 1
+        if self.start_time is None:
+            self.start_time = timestamp
+        was_active = self.active
+        self.active = (self.counter >= self.consec_frames and
+                       timestamp - self.start_time >= self.duration)
+        return self.active and not was_active
+
+    def reset(self):
+        """Forget the current run, as if the condition had just ended."""
+        self.counter = 0
+        self.start_time = None
+        self.active = False
+
+    def elapsed(self, timestamp):
+        """Seconds the condition has held at `timestamp`, or None."""
+        if self.start_time is None:
+            return None
+        return timestamp - self.start_time
+
+
+class DrowsinessState:
+    """Eye-closure and yawn timers for one driver."""
+
+    def __init__(self, eye_thresh=EYE_AR_THRESH, mouth_thresh=MOUTH_AR_THRESH,
+                 eye_seconds=EYE_CLOSED_SECONDS, mouth_seconds=MOUTH_OPEN_SECONDS,
+                 consec_frames=EYE_AR_CONSEC_FRAMES):
+        self.eye_thresh = eye_thresh
+        self.mouth_thresh = mouth_thresh
+        self.eyes = ConditionTimer(eye_seconds, consec_frames)
+        self.mouth = ConditionTimer(mouth_seconds, consec_frames)
+
+    def update(self, timestamp, ear, mor):
+        """Feed one frame's EAR/MOR, or None for both when no face was seen.
+
+        Frames without a face leave the timers as they are. Returns a dict
+        with the eyes_closed / mouth_open / alert_triggered flags for this
+        frame and the names of the timers that fired on it.
+        """
+        fired = []
+        if ear is not None and self.eyes.update(ear <= self.eye_thresh, timestamp):
+            fired.append("eyes_closed")
+        if mor is not None and self.mouth.update(mor > self.mouth_thresh, timestamp):
+            fired.append("mouth_open")
+        return self.flags(fired)
+
+    def reset(self):
+        """Stop both timers, e.g. when a different person takes the seat."""
+        self.eyes.reset()
+        self.mouth.reset()
+
+    def flags(self, fired=()):
+        """The current flags, in the form update() returns them."""
+        return {
+            "alert_triggered": self.eyes.active or self.mouth.active,
+            "eyes_closed": self.eyes.active,
+            "mouth_open": self.mouth.active,
+            "fired": list(fired),
+        }
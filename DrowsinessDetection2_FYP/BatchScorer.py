@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# Re-scores recorded footage offline with the same EAR/MOR/head pose logic as
+# the live detectors.
+#
+#   python BatchScorer.py trip1.mp4 trip2.mp4 frames_dir/ --out scores.csv --events alerts.csv
+#
+# Videos are split into chunks that are scored in parallel by a process pool,
+# each worker with its own preloaded landmark model. Workers only measure
+# frames; the eye/mouth timers are then replayed in the parent over the
+# chunks in order, driven by frame index / fps, so their state carries across
+# chunk boundaries exactly as if the video had been scored in one piece.
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import os
+import imutils
+import cv2
+from EAR import face_eye_aspect_ratios
+from MOR import face_mouth_opening_ratios
+from HeadPose import HeadPoseEstimator
+from FaceTracker import FaceTracker, REDETECT_INTERVAL
+from FaceDetector import ScaledDetector, DETECTION_SCALE
+from AlertTimer import DrowsinessState, EYE_AR_THRESH, MOUTH_AR_THRESH, EYE_AR_CONSEC_FRAMES
+from LandmarkBackend import get_backend, BACKENDS, LANDMARK_BACKEND, HEAD_POSE_POINTS
+from DriverSelector import DriverSelector, parse_region, box_iou, MIN_DRIVER_IOU
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+FRAME_FIELDS = ["source", "frame", "timestamp", "faces", "driver_changed", "ear", "mor", "head_tilt", "pitch", "yaw",
+                "roll", "eyes_closed", "mouth_open", "alert_triggered"]
+EVENT_FIELDS = ["source", "type", "started_at", "triggered_at"]
+
+# Per worker process models, set up once by init_worker. The parent
+# preloads them before the pool forks, so workers share them.
+detector = None
+backend = None
+
+
+def init_worker(backend_name, model_path, detection_scale):
+    global detector, backend
+    backend = get_backend(backend_name, model_path)
+    detector = ScaledDetector(backend.detector(), detection_scale)
+
+
+def list_images(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS))
+
+
+# Split a source into (source, start_frame, end_frame, fps) chunks
+def plan_chunks(source, chunk_seconds, default_fps):
+    if os.path.isdir(source):
+        frame_count = len(list_images(source))
+        fps = default_fps
+    else:
+        cap = cv2.VideoCapture(source)
+        if not cap.isOpened():
+            raise IOError("unable to open video {}".format(source))
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or default_fps
+        cap.release()
+
+    chunk_frames = max(int(chunk_seconds * fps), 1)
+    return [(source, start, min(start + chunk_frames, frame_count), fps)
+            for start in range(0, frame_count, chunk_frames)]
+
+
+def read_frames(source, start, end):
+    if os.path.isdir(source):
+        for index, path in enumerate(list_images(source)[start:end], start):
+            frame = cv2.imread(path)
+            if frame is not None:
+                yield index, frame
+        return
+
+    cap = cv2.VideoCapture(source)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    for index in range(start, end):
+        ok, frame = cap.read()
+        if not ok:
+            break
+        yield index, frame
+    cap.release()
+
+
+# Worker job: measure every frame of one chunk. For each frame returns
+# (frame index, timestamp, face count, whether the driver changed, driver's
+# face box, EAR, MOR, (head tilt, pitch, yaw, roll)) of the driver's face,
+# with None box and metrics when no driver was found. The first driver of
+# a chunk never counts as changed; main() checks it against the previous
+# chunk's.
+def score_chunk(chunk, frame_width, redetect_interval, seat_region=None):
+    source, start, end, fps = chunk
+    tracker = FaceTracker(detector, redetect_interval) if redetect_interval > 1 else detector
+    head_pose = HeadPoseEstimator()
+    driver_selector = DriverSelector(seat_region)
+    rows = []
+    for index, frame in read_frames(source, start, end):
+        if frame_width:
+            frame = imutils.resize(frame, width=frame_width)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        rects = tracker(gray, 0)
+        timestamp = index / fps
+        driver, changed = driver_selector.select(rects, gray.shape)
+        if driver is None or changed:
+            head_pose.reset()
+        if driver is None:
+            rows.append((index, timestamp, len(rects), False, None, None, None, (None, None, None, None)))
+            continue
+
+        box = driver_selector.box
+        shapes = backend.landmarks(gray, [rects[driver]])
+        ear = float(face_eye_aspect_ratios(shapes)[0])
+        mor = float(face_mouth_opening_ratios(shapes)[0])
+        if not backend.head_pose:
+            rows.append((index, timestamp, len(rects), changed, box, ear, mor, (None, None, None, None)))
+            continue
+        image_points = shapes[0][HEAD_POSE_POINTS].astype("double")
+        pose = head_pose.estimate(frame.shape, image_points, project=False)
+        rows.append((index, timestamp, len(rects), changed, box, ear, mor,
+                     (pose.head_tilt, pose.pitch, pose.yaw, pose.roll)))
+    return rows
+
+
+# Parquet output needs pandas and pyarrow, which are not in Requirements.txt.
+# Raises ValueError naming them when `path` is .parquet and they are missing.
+def check_output(path):
+    if not path.endswith(".parquet"):
+        return
+    try:
+        import pandas
+        import pyarrow
+    except ImportError:
+        raise ValueError("writing {} needs pandas and pyarrow (pip install pandas pyarrow); "
+                         "use a .csv path otherwise".format(path))
+
+
+class RowWriter:
+    """Writes dict rows to a CSV file, or to Parquet when the path ends in .parquet."""
+
+    def __init__(self, path, fields):
+        check_output(path)
+        self.path = path
+        self.fields = fields
+        self.parquet = path.endswith(".parquet")
+        if self.parquet:
+            # Parquet is written in one go at close
+            self.rows = []
+        else:
+            self.file = open(path, "w", newline="")
+            self.writer = csv.DictWriter(self.file, fieldnames=fields)
+            self.writer.writeheader()
+
+    def write(self, row):
+        if self.parquet:
+            self.rows.append(row)
+        else:
+            self.writer.writerow(row)
+
+    def close(self):
+        if self.parquet:
+            import pandas as pd
+            pd.DataFrame(self.rows, columns=self.fields).to_parquet(self.path, index=False)
+        else:
+            self.file.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Score recorded videos or image directories for drowsiness.")
+    ap.add_argument("sources", nargs="+", help="video files or directories of frames")
+    ap.add_argument("--out", default="scores.csv",
+                    help="per-frame output (.csv, or .parquet with pandas and pyarrow installed)")
+    ap.add_argument("--events", default="alerts.csv",
+                    help="alert event output (.csv, or .parquet with pandas and pyarrow installed)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="scoring processes")
+    ap.add_argument("--chunk-seconds", type=float, default=60.0, help="length of the chunks videos are split into")
+    ap.add_argument("--fps", type=float, default=30.0, help="frame rate of image directories, and of videos that do not report one")
+    ap.add_argument("--width", type=int, default=1024, help="resize frames to this width before scoring (0 keeps the original size)")
+    ap.add_argument("--detection-scale", type=float, default=DETECTION_SCALE)
+    ap.add_argument("--redetect-interval", type=int, default=REDETECT_INTERVAL)
+    ap.add_argument("--eye-thresh", type=float, default=EYE_AR_THRESH)
+    ap.add_argument("--mouth-thresh", type=float, default=MOUTH_AR_THRESH)
+    ap.add_argument("--consec-frames", type=int, default=EYE_AR_CONSEC_FRAMES)
+    ap.add_argument("--seat-region", help="left,top,right,bottom fractions of the frame the driver sits in "
+                                          "(default: largest face)")
+    ap.add_argument("--landmark-backend", choices=sorted(BACKENDS), default=LANDMARK_BACKEND)
+    ap.add_argument("--model", help="landmark model file (default: the backend's)")
+    args = vars(ap.parse_args())
+    try:
+        check_output(args["out"])
+        check_output(args["events"])
+    except ValueError as e:
+        ap.error(str(e))
+
+    chunks = []
+    for source in args["sources"]:
+        chunks.extend(plan_chunks(source, args["chunk_seconds"], args["fps"]))
+    print("[INFO] scoring {} source(s) in {} chunk(s) on {} worker(s)...".format(
+        len(args["sources"]), len(chunks), args["workers"]))
+
+    frames_out = RowWriter(args["out"], FRAME_FIELDS)
+    events_out = RowWriter(args["events"], EVENT_FIELDS)
+    state = None
+    current_source = None
+    alerts = 0
+    get_backend(args["landmark_backend"], args["model"]).preload()
+    with ProcessPoolExecutor(max_workers=args["workers"], initializer=init_worker,
+                             initargs=(args["landmark_backend"], args["model"], args["detection_scale"])) as pool:
+        results = pool.map(score_chunk, chunks, [args["width"]] * len(chunks),
+                           [args["redetect_interval"]] * len(chunks),
+                           [parse_region(args["seat_region"])] * len(chunks))
+        # map yields chunk results in submission order, so timers see every
+        # source's frames in sequence
+        for chunk, rows in zip(chunks, results):
+            source = chunk[0]
+            if source != current_source:
+                current_source = source
+                state = DrowsinessState(args["eye_thresh"], args["mouth_thresh"],
+                                        consec_frames=args["consec_frames"])
+                driver_box = None
+            first_driver = True
+            for (index, timestamp, faces, changed, box, ear, mor, (head_tilt, pitch, yaw, roll)) in rows:
+                if box is not None:
+                    # Each chunk picks its first driver afresh; a lone face
+                    # is the same driver, as in select_driver
+                    if (first_driver and driver_box is not None and faces > 1 and
+                            box_iou(box, driver_box) < MIN_DRIVER_IOU):
+                        changed = True
+                    first_driver = False
+                    driver_box = box
+                if changed:
+                    # Someone else took the seat
+                    state.reset()
+                result = state.update(timestamp, ear, mor)
+                frames_out.write({"source": source, "frame": index, "timestamp": timestamp, "faces": faces,
+                                  "driver_changed": changed, "ear": ear, "mor": mor, "head_tilt": head_tilt,
+                                  "pitch": pitch, "yaw": yaw, "roll": roll,
+                                  "eyes_closed": result["eyes_closed"], "mouth_open": result["mouth_open"],
+                                  "alert_triggered": result["alert_triggered"]})
+                for event_type in result["fired"]:
+                    timer = state.eyes if event_type == "eyes_closed" else state.mouth
+                    events_out.write({"source": source, "type": event_type,
+                                      "started_at": timer.start_time, "triggered_at": timestamp})
+                    alerts += 1
+
+    frames_out.close()
+    events_out.close()
+    print("[INFO] wrote {} and {} ({} alert(s))".format(args["out"], args["events"], alerts))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import json
+import math
+import os
+import sqlite3
+import time
+
+# Per-driver EAR/MOR thresholds learned from the driver's own stream. The
+# first CALIBRATION_SECONDS of normal driving (eyes open, mouth closed) give
+# the driver's baseline; thresholds are then placed a few standard
+# deviations from it and saved under the driver's id, so the next session
+# starts with them. Until then the default thresholds apply. 0 disables it.
+CALIBRATION_SECONDS = float(os.environ.get("DROWSINESS_CALIBRATION_SECONDS", 30))
+
+# Frames with a face needed before calibration may finish, however long it
+# has been running
+CALIBRATION_MIN_FRAMES = int(os.environ.get("DROWSINESS_CALIBRATION_MIN_FRAMES", 30))
+
+# SQLite database of driver id -> thresholds
+CALIBRATION_PATH = os.environ.get("DROWSINESS_CALIBRATION_PATH", "calibration.db")
+
+# Thresholds sit this many standard deviations below the open eye EAR and
+# above the closed mouth MOR
+THRESHOLD_STDS = 3.0
+
+# The eye threshold stays within these fractions of the open eye EAR and
+# the mouth threshold at least this far above the closed mouth MOR, so a
+# very steady or very noisy baseline cannot put them somewhere useless.
+# Frames past those bounds (blinks, talking) are left out of the baseline.
+EYE_THRESH_FRACTIONS = (0.5, 0.75)
+MOUTH_MIN_MARGIN = 0.2
+
+
+# Mean and variance of a stream of values, updated one value at a time
+# (Welford's algorithm), so no samples are kept
+class RunningStats:
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+
+def compute_thresholds(ear, mor):
+    low, high = EYE_THRESH_FRACTIONS
+    eye_thresh = min(max(ear.mean - THRESHOLD_STDS * ear.std, ear.mean * low), ear.mean * high)
+    mouth_thresh = max(mor.mean + THRESHOLD_STDS * mor.std, mor.mean + MOUTH_MIN_MARGIN)
+    return {"eye_thresh": eye_thresh, "mouth_thresh": mouth_thresh,
+            "ear_mean": ear.mean, "ear_std": ear.std, "mor_mean": mor.mean, "mor_std": mor.std,
+            "frames": ear.count}
+
+
+# Learns one driver's thresholds from the EAR/MOR of their frames, in
+# capture time. Feed it every frame with a face; add() returns the
+# thresholds on the frame calibration completes and None otherwise.
+class Calibrator:
+    def __init__(self, seconds=CALIBRATION_SECONDS, min_frames=CALIBRATION_MIN_FRAMES):
+        self.seconds = seconds
+        self.min_frames = min_frames
+        self.ear = RunningStats()
+        self.mor = RunningStats()
+        self.start_time = None
+        self.thresholds = None
+
+    @property
+    def done(self):
+        return self.thresholds is not None
+
+    def add(self, timestamp, ear, mor):
+        if self.done:
+            return None
+        if self.start_time is None:
+            self.start_time = timestamp
+
+        if self.ear.count == 0 or ear >= self.ear.mean * EYE_THRESH_FRACTIONS[1]:
+            self.ear.add(ear)
+        if self.mor.count == 0 or mor <= self.mor.mean + MOUTH_MIN_MARGIN:
+            self.mor.add(mor)
+
+        if (timestamp - self.start_time >= self.seconds and
+                self.ear.count >= self.min_frames and self.mor.count >= self.min_frames):
+            self.thresholds = compute_thresholds(self.ear, self.mor)
+            return self.thresholds
+        return None
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calibrations (
+    driver_id TEXT PRIMARY KEY,
+    thresholds TEXT NOT NULL,
+    calibrated_at REAL NOT NULL
+)
+"""
+
+
+# Saved thresholds by driver id, one row per driver in SQLite, so the
+# server's worker processes and the desktop app can share the file: every
+# save replaces just that driver's row, and every lookup reads the file.
+class CalibrationStore:
+    def __init__(self, path=CALIBRATION_PATH):
+        self.path = path
+        self._ready = False
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            db.execute(SCHEMA)
+            self._ready = True
+        return db
+
+    def get(self, driver_id):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT thresholds, calibrated_at FROM calibrations WHERE driver_id = ?",
+                             (driver_id,)).fetchone()
+        finally:
+            db.close()
+        if row is None:
+            return None
+        return dict(json.loads(row[0]), calibrated_at=row[1])
+
+    def put(self, driver_id, thresholds):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("INSERT OR REPLACE INTO calibrations VALUES (?, ?, ?)",
+                           (driver_id, json.dumps(thresholds, sort_keys=True), time.time()))
+        finally:
+            db.close()
+
+
+calibrations = CalibrationStore()
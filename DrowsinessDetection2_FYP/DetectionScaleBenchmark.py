@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Compares face detection at reduced scales against full resolution detection.
+# For every scale it reports detection + landmarking fps and the EAR error
+# against the full resolution path (landmarks always run on the full frame).
+#
+#   python DetectionScaleBenchmark.py --video drive.mp4 --scales 1.0,0.5,0.25
+from imutils import face_utils
+import argparse
+import imutils
+import os
+import time
+import cv2
+import numpy as np
+from EAR import eye_aspect_ratio
+from FaceDetector import ScaledDetector
+from ModelRegistry import get_detector, get_predictor, MODEL_PATH
+
+frame_width = 1024
+frame_height = 576
+
+
+def load_frames(args):
+    frames = []
+    if args["images"]:
+        for name in sorted(os.listdir(args["images"])):
+            frame = cv2.imread(os.path.join(args["images"], name))
+            if frame is not None:
+                frames.append(frame)
+    else:
+        cap = cv2.VideoCapture(args["video"] if args["video"] else 0)
+        while len(frames) < args["frames"]:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+
+    frames = frames[:args["frames"]]
+    return [cv2.cvtColor(imutils.resize(frame, width=frame_width, height=frame_height), cv2.COLOR_BGR2GRAY)
+            for frame in frames]
+
+
+def face_ears(gray, rects, predictor):
+    (lStart, lEnd) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
+    (rStart, rEnd) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
+    ears = []
+    for rect in rects:
+        shape = face_utils.shape_to_np(predictor(gray, rect))
+        ear = (eye_aspect_ratio(shape[lStart:lEnd]) + eye_aspect_ratio(shape[rStart:rEnd])) / 2.0
+        center = ((rect.left() + rect.right()) / 2.0, (rect.top() + rect.bottom()) / 2.0)
+        ears.append((center, ear))
+    return ears
+
+
+# Pair each reference face with the nearest face found at this scale
+def ear_errors(reference, found):
+    errors = []
+    for (center, ear) in reference:
+        if not found:
+            continue
+        nearest = min(found, key=lambda face: np.hypot(face[0][0] - center[0], face[0][1] - center[1]))
+        errors.append(abs(nearest[1] - ear))
+    return errors
+
+
+def run_scale(frames, detector, predictor, scale):
+    scaled = ScaledDetector(detector, scale)
+    results = []
+    start = time.perf_counter()
+    for gray in frames:
+        results.append(face_ears(gray, scaled(gray, 0), predictor))
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--video", help="video file to read frames from (default: camera 0)")
+    ap.add_argument("--images", help="directory of images to use instead of a video")
+    ap.add_argument("--frames", type=int, default=200, help="number of frames to benchmark")
+    ap.add_argument("--scales", default="1.0,0.5,0.25", help="comma separated detection scales")
+    ap.add_argument("--model", default=MODEL_PATH)
+    args = vars(ap.parse_args())
+
+    frames = load_frames(args)
+    if not frames:
+        print("[ERROR] No frames to benchmark.")
+        return
+
+    detector = get_detector()
+    predictor = get_predictor(args["model"])
+    scales = [float(s) for s in args["scales"].split(",")]
+
+    reference, _ = run_scale(frames, detector, predictor, 1.0)
+    reference_faces = sum(len(faces) for faces in reference)
+
+    print("[INFO] {} frames at {}x{}, {} faces at full resolution".format(
+        len(frames), frames[0].shape[1], frames[0].shape[0], reference_faces))
+    print("{:>6} {:>8} {:>10} {:>10} {:>12} {:>12}".format(
+        "scale", "fps", "ms/frame", "faces", "mean |dEAR|", "max |dEAR|"))
+    for scale in scales:
+        results, elapsed = run_scale(frames, detector, predictor, scale)
+        errors = []
+        for ref, found in zip(reference, results):
+            errors.extend(ear_errors(ref, found))
+        print("{:>6.2f} {:>8.1f} {:>10.2f} {:>10} {:>12.4f} {:>12.4f}".format(
+            scale, len(frames) / elapsed, 1000.0 * elapsed / len(frames),
+            sum(len(faces) for faces in results),
+            np.mean(errors) if errors else float("nan"),
+            np.max(errors) if errors else float("nan")))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,100 +1,360 @@
 #!/usr/bin/env python
-from scipy.spatial import distance as dist
 from imutils.video import VideoStream
 from imutils import face_utils
 import argparse
 import imutils
 import time
-import dlib
 import math
 import cv2
 import numpy as np
 from EAR import eye_aspect_ratio
 from MOR import mouth_opening_ratio
-from HeadPose import getHeadTiltAndCoords
+from HeadPose import HeadPoseEstimator
+from FaceTracker import FaceTracker, REDETECT_INTERVAL
+from FaceDetector import ScaledDetector, DETECTION_SCALE
+from AlertTimer import ConditionTimer, EYE_CLOSED_SECONDS, MOUTH_OPEN_SECONDS
 import os
+import sys
+import json
+import itertools
+import queue
+import threading
+# pygame prints a banner to stdout on import, where headless metrics go
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
 import pygame
-
+from Pipeline import DropOldestQueue, Stage, StageTimer
+from Metrics import Counter, Histogram, COUNT_BUCKETS
+from LandmarkBackend import get_backend, BACKENDS, LANDMARK_BACKEND, HEAD_POSE_POINTS
+from DriverSelector import DriverSelector, parse_region
+from Calibration import Calibrator, calibrations, CALIBRATION_SECONDS
+from FrameDiff import is_unchanged, region_reference, CHANGE_THRESHOLD, MAX_REUSED_FRAMES
+from FramePacer import near_thresholds
+
+# Face detector and landmark backend, loaded up front
 def initialize_detector():
-    print("[INFO] loading facial landmark predictor...")
-    detector = dlib.get_frontal_face_detector()
-    predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
-    return detector, predictor
+    backend = get_backend(landmark_backend, model_path)
+    backend.preload()
+    return backend.detector(), backend
 
 # Initialize pygame mixer explicitly
 def initialize_mixer():
     try:
         pygame.mixer.quit()  # Ensure no previous mixer is running
         pygame.mixer.init(frequency=44100, size=-16, channels=2, buffer=512)
-        print("[INFO] Mixer initialized successfully.")
+        log("[INFO] Mixer initialized successfully.")
     except Exception as e:
-        print(f"[ERROR] Unable to initialize mixer: {e}")
+        log(f"[ERROR] Unable to initialize mixer: {e}")
         raise
 
 
+# Path of the alert sound and the shortest gap between two alerts, in seconds
+ALERT_SOUND_PATH = os.path.join("Sound", "AlertSound.wav")
+ALERT_COOLDOWN = 3.0
+
+
+class AlertPlayer:
+    """Plays a preloaded alert sound on a reserved mixer channel.
+
+    Playback runs on pygame's mixer thread, so play() returns at once.
+    Triggers while the sound is still playing or within `cooldown` seconds
+    of the last one are dropped.
+    """
+
+    def __init__(self, sound_path, cooldown=ALERT_COOLDOWN):
+        if not pygame.mixer.get_init():
+            initialize_mixer()
+        pygame.mixer.set_reserved(1)
+        self.sound = pygame.mixer.Sound(sound_path)
+        self.channel = pygame.mixer.Channel(0)
+        self.cooldown = cooldown
+        self.last_played = None
+
+    def play(self):
+        now = time.monotonic()
+        if self.channel.get_busy():
+            return False
+        if self.last_played is not None and now - self.last_played < self.cooldown:
+            return False
+        self.channel.play(self.sound)
+        self.last_played = now
+        return True
+
+
+alert_players = {}
+
+
+def load_alert_sound(file_path):
+    player = alert_players.get(file_path)
+    if player is None:
+        player = alert_players[file_path] = AlertPlayer(file_path)
+    return player
+
+
+# How much to draw on each frame: nothing (headless), face box, ratios and
+# alerts only, or everything including all 68 numbered landmarks
+OVERLAY_NONE = 0
+OVERLAY_MINIMAL = 1
+OVERLAY_FULL = 2
+OVERLAY_LEVELS = {"none": OVERLAY_NONE, "minimal": OVERLAY_MINIMAL, "full": OVERLAY_FULL}
+overlay_level = OVERLAY_FULL
+
+# Headless runs skip the display window; per-frame metrics go to
+# metrics_out (a file or stdout) as JSON lines when it is set
+headless = False
+metrics_out = None
+
+
+def emit_metrics(captured_at, metrics):
+    if metrics_out is None:
+        return
+    metrics_out.write(json.dumps(dict(metrics, timestamp=captured_at)) + "\n")
+    metrics_out.flush()
+
+
+# Shows the frame unless headless; returns the key pressed, if any
+def show_frame(frame):
+    if headless:
+        return -1
+    cv2.imshow("Frame", frame)
+    return cv2.waitKey(1) & 0xFF
+
+
+# Per-stage latency, faces per frame and alert counts, summarised every
+# summary_interval seconds
+stage_seconds = Histogram("drowsiness_stage_seconds", "Time spent in each inference stage per frame",
+                          ["stage"])
+faces_per_frame = Histogram("drowsiness_faces_per_frame", "Faces found per frame", buckets=COUNT_BUCKETS)
+alerts_total = Counter("drowsiness_alerts_total", "Alerts fired", ["type"])
+frames_reused_total = Counter("drowsiness_frames_reused_total",
+                              "Frames that reused the previous analysis because the eye and mouth regions barely "
+                              "changed")
+SUMMARY_STAGES = ["detect", "landmarks", "head_pose", "ratios"]
+
+
+class MetricsSummary:
+    def __init__(self):
+        self.last_frames = 0
+        self.last_time = time.perf_counter()
+
+    def line(self):
+        now = time.perf_counter()
+        frames = faces_per_frame.labels().count
+        fps = (frames - self.last_frames) / (now - self.last_time) if now > self.last_time else 0.0
+        self.last_frames, self.last_time = frames, now
+        stages = ", ".join("{} avg {:.1f} p99 <{:.1f} ms".format(
+            stage, 1000.0 * stage_seconds.labels(stage).mean(), 1000.0 * stage_seconds.labels(stage).quantile(0.99))
+            for stage in SUMMARY_STAGES)
+        alerts = sum(child.value for _, child in alerts_total.children())
+        return "{:.1f} fps, {:.2f} faces/frame, {:.0f} alert(s), {:.0f} frame(s) reused | {}".format(
+            fps, faces_per_frame.labels().mean(), alerts, frames_reused_total.labels().value, stages)
+
+
+# Status lines go to stderr when stdout carries the JSON metrics
+def log(message):
+    print(message, file=sys.stderr if metrics_out is sys.stdout else sys.stdout)
+
+
 def initialize_camera():
-    print("[INFO] initializing camera...")
+    log("[INFO] initializing camera...")
     vs = VideoStream(src=0).start()
     time.sleep(2.0)
     return vs
 
 
-def process_frame(frame, gray, detector, predictor):
-    rects = detector(gray, 0)
-    if len(rects) > 0:
+# Returns the annotated frame and this frame's metrics. Timers run on the
+# frame's capture time, which defaults to now.
+def process_frame(frame, gray, detector, backend, captured_at=None):
+    global calibrator, save_calibration, last_analysis, reused_frames
+    if captured_at is None:
+        captured_at = time.time()
+
+    # When the driver's eye and mouth regions have barely changed since the
+    # last analyzed frame, reuse its faces, landmarks and head pose. Never
+    # while a timer is running or the driver's EAR/MOR are near a threshold.
+    with state_lock:
+        previous = last_analysis if reused_frames < MAX_REUSED_FRAMES else None
+        if previous is not None and (eye_timer.start_time is not None or mouth_timer.start_time is not None or
+                                     near_thresholds(previous[4], previous[5], EYE_AR_THRESH, MOUTH_AR_THRESH)):
+            previous = None
+    reused = False
+    if previous is not None:
+        start = time.perf_counter()
+        reused, _ = is_unchanged(gray, previous[0], change_threshold)
+        stage_seconds.labels("change").observe(time.perf_counter() - start)
+    if reused:
+        (_, rects, shape, pose, _, _) = previous
+        frames_reused_total.inc()
+    else:
+        start = time.perf_counter()
+        rects = detector(gray, 0)
+        stage_seconds.labels("detect").observe(time.perf_counter() - start)
+    faces_per_frame.observe(len(rects))
+    if len(rects) > 0 and overlay_level >= OVERLAY_MINIMAL:
         text = "{} face(s) found".format(len(rects))
         cv2.putText(frame, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
 
-    for rect in rects:
-        (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
-        cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (0, 255, 0), 1)
-        shape = predictor(gray, rect)
-        shape = face_utils.shape_to_np(shape)
-
-        process_landmarks(frame, shape)
-        process_eyes(frame, shape)  # Check eye conditions
-        process_mouth(frame, shape)  # Check mouth conditions
+    # Only the driver's face is landmarked and scored; passengers are just
+    # outlined
+    with state_lock:  # The driver's identity is shared by all inference workers
+        driver, changed = driver_selector.select(rects, gray.shape)
+        if changed:
+            # Someone else took the seat; their thresholds are learned for
+            # this run only, as they may not be --driver-id
+            eye_timer.reset()
+            mouth_timer.reset()
+            if calibration_seconds > 0:
+                calibrator = Calibrator(calibration_seconds)
+                save_calibration = False
+        driver_id = driver_selector.driver_id if driver is not None else None
+    if overlay_level >= OVERLAY_MINIMAL:
+        for i, rect in enumerate(rects):
+            if i != driver:
+                (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
+                cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (128, 128, 128), 1)
+
+    metrics = {"faces": len(rects), "driver_id": driver_id, "ear": None, "mor": None,
+               "head_tilt": None, "pitch": None, "yaw": None, "roll": None}
+    if driver is None or changed:
+        head_pose_estimator().reset()
+    if driver is not None:
+        rect = rects[driver]
+        if overlay_level >= OVERLAY_MINIMAL:
+            (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
+            cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (0, 255, 0), 1)
+
+        if not reused:
+            # Landmarks in the 68 point layout
+            start = time.perf_counter()
+            shape = backend.landmarks(gray, [rect])[0]
+            stage_seconds.labels("landmarks").observe(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            pose = process_landmarks(frame, shape, backend)
+            stage_seconds.labels("head_pose").observe(time.perf_counter() - start)
+        if pose is not None:
+            metrics.update(head_tilt=pose.head_tilt, pitch=pose.pitch, yaw=pose.yaw, roll=pose.roll)
+        start = time.perf_counter()
+        with state_lock:  # Timers are shared by all inference workers
+            # The timers advance on reused frames too
+            metrics["ear"] = process_eyes(frame, shape, captured_at)  # Check eye conditions
+            metrics["mor"] = process_mouth(frame, shape, captured_at)  # Check mouth conditions
+            if not reused:
+                update_calibration(captured_at, metrics["ear"], metrics["mor"])
+        stage_seconds.labels("ratios").observe(time.perf_counter() - start)
         process_head_pose(frame, shape, frame.shape)
 
-    return frame
-
-def process_landmarks(frame, shape):
-    image_points = np.zeros((6, 2), dtype="double")
-    for (i, (x, y)) in enumerate(shape):
-        if i in [33, 8, 36, 45, 48, 54]:
-            idx = [33, 8, 36, 45, 48, 54].index(i)
-            image_points[idx] = (x, y)
-            color = (0, 255, 0)
+    with state_lock:
+        if reused:
+            reused_frames += 1
         else:
-            color = (0, 0, 255)
-        cv2.circle(frame, (x, y), 1, color, -1)
-        cv2.putText(frame, str(i + 1), (x - 10, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, color, 1)
-
-    for p in image_points:
-        cv2.circle(frame, (int(p[0]), int(p[1])), 3, (0, 0, 255), -1)
-
-    (head_tilt_degree, start_point, end_point, end_point_alt) = getHeadTiltAndCoords(frame.shape, image_points,
-                                                                                     frame.shape[0])
-    cv2.line(frame, start_point, end_point, (255, 0, 0), 2)
-    cv2.line(frame, start_point, end_point_alt, (0, 0, 255), 2)
-
-    if head_tilt_degree:
-        cv2.putText(frame, 'Head Tilt Degree: ' + str(head_tilt_degree[0]), (170, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+            reused_frames = 0
+            last_analysis = None
+            if driver is not None and change_threshold > 0:
+                reference = region_reference(gray, shape)
+                if reference is not None:
+                    last_analysis = (reference, rects, shape, pose, metrics["ear"], metrics["mor"])
+
+    metrics["eyes_alert"] = eye_timer.active
+    metrics["mouth_alert"] = mouth_timer.active
+    metrics["calibrating"] = calibrator is not None
+    metrics["reused"] = reused
+    if calibrator is not None and overlay_level >= OVERLAY_MINIMAL:
+        cv2.putText(frame, "Calibrating...", (10, 80), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+    return frame, metrics
+
+# One warm-started head pose estimator per inference thread
+head_pose_estimators = threading.local()
+
+
+def head_pose_estimator():
+    estimator = getattr(head_pose_estimators, "estimator", None)
+    if estimator is None:
+        estimator = head_pose_estimators.estimator = HeadPoseEstimator()
+    return estimator
+
+
+# Returns the head pose (tilt, pitch, yaw, roll in degrees), or None when
+# the backend's landmarks do not cover the head pose points
+def process_landmarks(frame, shape, backend):
+    if overlay_level >= OVERLAY_FULL:
+        for i in backend.points:
+            (x, y) = shape[i]
+            if i in HEAD_POSE_POINTS:
+                color = (0, 255, 0)
+            else:
+                color = (0, 0, 255)
+            cv2.circle(frame, (x, y), 1, color, -1)
+            cv2.putText(frame, str(i + 1), (x - 10, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, color, 1)
+    if not backend.head_pose:
+        return None
+
+    image_points = shape[HEAD_POSE_POINTS].astype("double")
+    if overlay_level >= OVERLAY_FULL:
+        for p in image_points:
+            cv2.circle(frame, (int(p[0]), int(p[1])), 3, (0, 0, 255), -1)
+
+    # The nose line is only projected when it is going to be drawn
+    pose = head_pose_estimator().estimate(frame.shape, image_points, project=overlay_level >= OVERLAY_FULL)
+    if overlay_level >= OVERLAY_FULL:
+        cv2.line(frame, pose.start_point, pose.end_point, (255, 0, 0), 2)
+        cv2.line(frame, pose.start_point, pose.end_point_alt, (0, 0, 255), 2)
+
+    if pose.head_tilt and overlay_level >= OVERLAY_MINIMAL:
+        cv2.putText(frame, 'Head Tilt Degree: ' + str(pose.head_tilt), (170, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
                     (0, 0, 255), 2)
+    return pose
 
 
 from playsound import playsound  # Import playsound for playing audio
 import time  # For time tracking
 
-start_time_eyes = None  # Timer for eyes closed condition
-alert_triggered_eyes = False
-
-start_time_mouth = None  # Timer for mouth open condition
-alert_triggered_mouth = False
-
-def process_eyes(frame, shape):
-    global start_time_eyes, alert_triggered_eyes
-
+eye_timer = ConditionTimer(EYE_CLOSED_SECONDS)  # Timer for eyes closed condition
+mouth_timer = ConditionTimer(MOUTH_OPEN_SECONDS)  # Timer for mouth open condition
+
+# Picks the driver among the faces in view (--seat-region)
+driver_selector = DriverSelector()
+
+# (eye and mouth regions, faces, landmarks, head pose, EAR, MOR) of the last
+# analyzed frame with a driver, reused while those regions stay unchanged
+# (--change-threshold, see FrameDiff)
+last_analysis = None
+reused_frames = 0
+change_threshold = CHANGE_THRESHOLD
+
+state_lock = threading.Lock()
+
+# Thresholds are loaded for --driver-id, or learned from the first
+# --calibration-seconds of driving (eyes open, mouth closed) and saved
+# under it. The defaults apply until then. Thresholds learned after a seat
+# change are not saved (save_calibration).
+calibrator = None
+save_calibration = True
+calibration_seconds = CALIBRATION_SECONDS
+driver_key = "default"
+
+
+# Feed the driver's EAR/MOR to the running calibration and switch to the
+# learned thresholds once it completes. Called under state_lock.
+def update_calibration(captured_at, ear, mor):
+    global calibrator, EYE_AR_THRESH, MOUTH_AR_THRESH
+    if calibrator is None:
+        return
+    thresholds = calibrator.add(captured_at, ear, mor)
+    if thresholds is None:
+        return
+    EYE_AR_THRESH = thresholds["eye_thresh"]
+    MOUTH_AR_THRESH = thresholds["mouth_thresh"]
+    calibrator = None
+    if not save_calibration:
+        log("[INFO] calibrated the new driver: eye threshold {:.3f}, mouth threshold {:.3f} (not saved)".format(
+            EYE_AR_THRESH, MOUTH_AR_THRESH))
+        return
+    calibrations.put(driver_key, thresholds)
+    log("[INFO] calibrated {}: eye threshold {:.3f}, mouth threshold {:.3f}".format(
+        driver_key, EYE_AR_THRESH, MOUTH_AR_THRESH))
+
+
+def process_eyes(frame, shape, captured_at):
     (lStart, lEnd) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
     (rStart, rEnd) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
 
@@ -105,57 +365,51 @@ def process_eyes(frame, shape):
     ear = (leftEAR + rightEAR) / 2.0
 
     # Draw eye contours
-    leftEyeHull = cv2.convexHull(leftEye)
-    rightEyeHull = cv2.convexHull(rightEye)
-    cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
-    cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
+    if overlay_level >= OVERLAY_FULL:
+        leftEyeHull = cv2.convexHull(leftEye)
+        rightEyeHull = cv2.convexHull(rightEye)
+        cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
+        cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
 
     # Display EAR value
-    cv2.putText(frame, "EAR: {:.2f}".format(ear), (850, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    if overlay_level >= OVERLAY_MINIMAL:
+        cv2.putText(frame, "EAR: {:.2f}".format(ear), (850, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
     # Check if EAR is below the threshold
-    if ear <= EYE_AR_THRESH:
+    eyes_closed = ear <= EYE_AR_THRESH
+    if eyes_closed and overlay_level >= OVERLAY_MINIMAL:
         cv2.putText(frame, "Eyes Closed!", (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
-        if start_time_eyes is None:
-            start_time_eyes = time.time()
-        else:
-            duration = time.time() - start_time_eyes
-            if duration >= 2 and not alert_triggered_eyes:
-                alert_triggered_eyes = True
-                cv2.putText(frame, "Drowsy! Eyes Alert Triggered!", (500, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                sound_path = os.path.join("Sound", "AlertSound.wav")
-                play_alert_sound(sound_path)
-    else:
-        start_time_eyes = None
-        alert_triggered_eyes = False
-
-def process_mouth(frame, shape):
-    global start_time_mouth, alert_triggered_mouth
+    # Alert once the eyes have been closed for EYE_CLOSED_SECONDS
+    if eye_timer.update(eyes_closed, captured_at):
+        alerts_total.labels("eyes_closed").inc()
+        if overlay_level >= OVERLAY_MINIMAL:
+            cv2.putText(frame, "Drowsy! Eyes Alert Triggered!", (500, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        play_alert_sound(ALERT_SOUND_PATH)
+    return ear
 
+def process_mouth(frame, shape, captured_at):
     (mStart, mEnd) = (49, 68)
     mouth = shape[mStart:mEnd]
     mor = mouth_opening_ratio(mouth)
 
-    mouthHull = cv2.convexHull(mouth)
-    cv2.drawContours(frame, [mouthHull], -1, (0, 255, 0), 1)
-    cv2.putText(frame, "MOR: {:.2f}".format(mor), (650, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    if overlay_level >= OVERLAY_FULL:
+        mouthHull = cv2.convexHull(mouth)
+        cv2.drawContours(frame, [mouthHull], -1, (0, 255, 0), 1)
+    if overlay_level >= OVERLAY_MINIMAL:
+        cv2.putText(frame, "MOR: {:.2f}".format(mor), (650, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
-    if mor > MOUTH_AR_THRESH:
+    mouth_open = mor > MOUTH_AR_THRESH
+    if mouth_open and overlay_level >= OVERLAY_MINIMAL:
         cv2.putText(frame, "Mouth Open!", (250, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
 
-        if start_time_mouth is None:
-            start_time_mouth = time.time()
-        else:
-            duration = time.time() - start_time_mouth
-            if duration >= 5 and not alert_triggered_mouth:
-                alert_triggered_mouth = True
-                cv2.putText(frame, "Yawning! Mouth Alert Triggered!", (800, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                sound_path = os.path.join("Sound", "AlertSound.wav")
-                play_alert_sound(sound_path)
-    else:
-        start_time_mouth = None
-        alert_triggered_mouth = False
+    # Alert once the mouth has been open for MOUTH_OPEN_SECONDS
+    if mouth_timer.update(mouth_open, captured_at):
+        alerts_total.labels("mouth_open").inc()
+        if overlay_level >= OVERLAY_MINIMAL:
+            cv2.putText(frame, "Yawning! Mouth Alert Triggered!", (800, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        play_alert_sound(ALERT_SOUND_PATH)
+    return mor
 
 
 def process_head_pose(frame, shape, frame_shape):
@@ -169,49 +423,226 @@ def process_head_pose(frame, shape, frame_shape):
         shape[54]   # Right mouth corner
     ], dtype="double")
 
+def build_detector(detector):
+    # Detect on a downscaled copy; landmarks still use the full resolution gray frame
+    detector = ScaledDetector(detector, detection_scale)
+    if redetect_interval > 1:
+        # Track faces between full detections instead of running HOG on every frame
+        detector = FaceTracker(detector, redetect_interval)
+    return detector
+
+
+def print_stage_summary(timers, queues, summary):
+    log("[INFO] " + " | ".join(timer.summary() for timer in timers) +
+        " | dropped " + ", ".join("{}={}".format(name, q.dropped) for name, q in queues))
+    log("[INFO] " + summary.line())
+
+
+def run_threaded(base_detector, backend):
+    # Capture thread -> inference worker(s) -> render on the main thread
+    # (cv2.imshow must stay on the main thread). Queues drop their oldest
+    # frame when full so what is shown is never more than a frame or two old.
+    stop = threading.Event()
+    frames = DropOldestQueue(maxsize=queue_size)
+    results = DropOldestQueue(maxsize=queue_size)
+    cap = cv2.VideoCapture(0)
+    sequence = itertools.count()
+
+    def capture():
+        ok, frame = cap.read()
+        if not ok:
+            log("[ERROR] Unable to read from camera. Exiting...")
+            return None
+        frame = imutils.resize(frame, width=frame_width, height=frame_height)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return next(sequence), time.time(), frame, gray
+
+    def make_inference(detector):
+        def infer(item):
+            index, captured_at, frame, gray = item
+            frame, metrics = process_frame(frame, gray, detector, backend, captured_at)
+            return index, captured_at, frame, metrics
+        return infer
+
+    capture_stage = Stage("capture", capture, None, frames, stop)
+    inference_timer = StageTimer("inference")
+    inference_stages = [
+        # Each worker tracks faces with its own detector
+        Stage("inference-{}".format(i), make_inference(build_detector(base_detector)),
+              frames, results, stop, inference_timer)
+        for i in range(inference_workers)
+    ]
+    render_timer = StageTimer("render")
+    timers = [capture_stage.timer, inference_timer, render_timer]
+
+    for stage in [capture_stage] + inference_stages:
+        stage.start()
+
+    last_shown = -1
+    last_summary = time.time()
+    summary = MetricsSummary()
+    try:
+        while not stop.is_set():
+            try:
+                index, captured_at, frame, metrics = results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if index < last_shown:
+                continue  # Overtaken by a newer frame from another worker
+            last_shown = index
+
+            start = time.perf_counter()
+            emit_metrics(captured_at, metrics)
+            key = show_frame(frame)
+            render_timer.record(time.perf_counter() - start)
+
+            if time.time() - last_summary >= summary_interval:
+                print_stage_summary(timers, [("capture", frames), ("inference", results)], summary)
+                last_summary = time.time()
+
+            if key == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+
+    stop.set()
+    for stage in [capture_stage] + inference_stages:
+        stage.join()
+    print_stage_summary(timers, [("capture", frames), ("inference", results)], summary)
+    if not headless:
+        cv2.destroyAllWindows()
+    cap.release()
+    failed = sum(stage.failed for stage in inference_stages)
+    if failed:
+        log("[ERROR] {} frame(s) dropped after an inference error".format(failed))
+    if capture_stage.error is not None:
+        raise capture_stage.error
+
+
 def main():
-    detector, predictor = initialize_detector()
+    detector, backend = initialize_detector()
+    # Load the alert sound up front so the first alert does not hit the disk
+    try:
+        load_alert_sound(ALERT_SOUND_PATH)
+    except Exception as e:
+        log(f"[ERROR] Unable to load alert sound: {e}")
+
+    if threaded:
+        run_threaded(detector, backend)
+        return
+
+    detector = build_detector(detector)
     vs = initialize_camera()
+    last_summary = time.time()
+    summary = MetricsSummary()
 
-    while True:
-        frame = vs.read()
-        if frame is None:
-            print("[ERROR] Unable to read from camera. Exiting...")
-            break
+    try:
+        while True:
+            frame = vs.read()
+            captured_at = time.time()
+            if frame is None:
+                log("[ERROR] Unable to read from camera. Exiting...")
+                break
 
-        frame = imutils.resize(frame, width=frame_width, height=frame_height)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            frame = imutils.resize(frame, width=frame_width, height=frame_height)
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        frame = process_frame(frame, gray, detector, predictor)
+            frame, metrics = process_frame(frame, gray, detector, backend, captured_at)
+            emit_metrics(captured_at, metrics)
 
-        cv2.imshow("Frame", frame)
-        key = cv2.waitKey(1) & 0xFF
+            key = show_frame(frame)
 
-        if key == ord("q"):
-            break
+            if time.time() - last_summary >= summary_interval:
+                log("[INFO] " + summary.line())
+                last_summary = time.time()
 
-    cv2.destroyAllWindows()
+            if key == ord("q"):
+                break
+    except KeyboardInterrupt:
+        pass
+
+    log("[INFO] " + summary.line())
+    if not headless:
+        cv2.destroyAllWindows()
     vs.stop()
 
 def play_alert_sound(file_path):
-    """Play an alert sound when drowsiness is detected."""
+    """Play an alert sound when drowsiness is detected, without blocking the frame loop."""
     try:
-        # Reinitialize mixer before playback
-        if not pygame.mixer.get_init():
-            initialize_mixer()
-
-        pygame.mixer.music.load(file_path)  # Load the MP3 file
-        pygame.mixer.music.play()  # Play the sound
-        while pygame.mixer.music.get_busy():  # Wait until the sound finishes
-            time.sleep(0.1)
+        load_alert_sound(file_path).play()
     except Exception as e:
-        print(f"[ERROR] Unable to play sound: {e}")
+        log(f"[ERROR] Unable to play sound: {e}")
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--redetect-interval", type=int, default=REDETECT_INTERVAL,
+                    help="run full face detection every N frames and track in between (1 disables tracking)")
+    ap.add_argument("--detection-scale", type=float, default=DETECTION_SCALE,
+                    help="run face detection on a copy downscaled by this factor, e.g. 0.5")
+    ap.add_argument("--threaded", action="store_true",
+                    help="run capture, inference and rendering as separate pipeline stages")
+    ap.add_argument("--inference-workers", type=int, default=1,
+                    help="number of inference threads in threaded mode; dlib's face detector holds the GIL "
+                         "and runs one frame at a time, so more than 1 only overlaps drawing and head pose "
+                         "with detection")
+    ap.add_argument("--queue-size", type=int, default=2,
+                    help="frames buffered between stages before the oldest is dropped")
+    ap.add_argument("--summary-interval", type=float, default=5.0,
+                    help="seconds between latency/throughput summaries")
+    ap.add_argument("--headless", action="store_true",
+                    help="no display window; per-frame metrics go to stdout unless --metrics-out is given")
+    ap.add_argument("--overlay", choices=sorted(OVERLAY_LEVELS),
+                    help="what to draw on frames (default: full, or none when headless)")
+    ap.add_argument("--metrics-out",
+                    help="append per-frame metrics as JSON lines to this file ('-' for stdout)")
+    ap.add_argument("--landmark-backend", choices=sorted(BACKENDS), default=LANDMARK_BACKEND,
+                    help="face detector and landmark model to use")
+    ap.add_argument("--model", help="landmark model file (default: the backend's)")
+    ap.add_argument("--seat-region",
+                    help="left,top,right,bottom fractions of the frame the driver sits in (default: largest face)")
+    ap.add_argument("--driver-id", default="default",
+                    help="driver whose calibrated thresholds are loaded, or saved once learned")
+    ap.add_argument("--calibration-seconds", type=float, default=CALIBRATION_SECONDS,
+                    help="seconds of driving to learn the driver's thresholds from (0 keeps the defaults)")
+    ap.add_argument("--change-threshold", type=float, default=CHANGE_THRESHOLD,
+                    help="reuse the last analysis while no pixel of the eye and mouth regions changes by this "
+                         "many gray levels (default 0: analyze every frame; not yet validated on real footage)")
+    ap.add_argument("--recalibrate", action="store_true",
+                    help="learn the driver's thresholds again even if some are saved")
+    args = vars(ap.parse_args())
+
+    if args["seat_region"]:
+        driver_selector = DriverSelector(parse_region(args["seat_region"]))
+    landmark_backend = args["landmark_backend"]
+    model_path = args["model"]
+    redetect_interval = args["redetect_interval"]
+    detection_scale = args["detection_scale"]
+    threaded = args["threaded"]
+    inference_workers = args["inference_workers"]
+    queue_size = args["queue_size"]
+    summary_interval = args["summary_interval"]
+    headless = args["headless"]
+    overlay = args["overlay"] or ("none" if headless else "full")
+    overlay_level = OVERLAY_LEVELS[overlay]
+    if args["metrics_out"] == "-" or (headless and args["metrics_out"] is None):
+        metrics_out = sys.stdout
+    elif args["metrics_out"]:
+        metrics_out = open(args["metrics_out"], "a", buffering=1)
     EYE_AR_THRESH = 0.23
     MOUTH_AR_THRESH = 0.65
-    EYE_AR_CONSEC_FRAMES = 3
-    COUNTER = 0
+    driver_key = args["driver_id"]
+    calibration_seconds = args["calibration_seconds"]
+    change_threshold = args["change_threshold"]
+    thresholds = None if args["recalibrate"] else calibrations.get(driver_key)
+    if thresholds is not None:
+        EYE_AR_THRESH = thresholds["eye_thresh"]
+        MOUTH_AR_THRESH = thresholds["mouth_thresh"]
+        log("[INFO] loaded thresholds for {}: eye {:.3f}, mouth {:.3f}".format(
+            driver_key, EYE_AR_THRESH, MOUTH_AR_THRESH))
+    elif calibration_seconds > 0:
+        calibrator = Calibrator(calibration_seconds)
+        log("[INFO] calibrating {} over the first {:g} seconds of driving...".format(
+            driver_key, calibration_seconds))
     frame_width = 1024
     frame_height = 576
 
@@ -0,0 +1,118 @@
+import os
+
+# A face found in the same place as the last frame's driver (box overlap
+# at least this much) is still the driver, even if another face is larger
+MIN_DRIVER_IOU = 0.3
+
+# Frames in a row another face has to be picked as the driver before it
+# counts as a different person, so a misdetection or a passenger leaning
+# in for a moment does not reset the driver's timers
+DRIVER_CHANGE_FRAMES = 3
+
+
+# Parse a seat region given as "left,top,right,bottom" fractions of the
+# frame, e.g. "0.5,0,1,1" for the right half. Empty means anywhere.
+def parse_region(text):
+    if not text:
+        return None
+    region = tuple(float(v) for v in text.split(","))
+    if len(region) != 4 or not (0 <= region[0] < region[2] <= 1 and 0 <= region[1] < region[3] <= 1):
+        raise ValueError("seat region must be left,top,right,bottom fractions, got {!r}".format(text))
+    return region
+
+
+# Part of the frame the driver sits in; None takes the largest face anywhere
+DRIVER_REGION = parse_region(os.environ.get("DROWSINESS_DRIVER_REGION"))
+
+
+# (left, top, right, bottom) of a dlib rectangle or a box list
+def as_box(rect):
+    if hasattr(rect, "left"):
+        return (rect.left(), rect.top(), rect.right(), rect.bottom())
+    return tuple(rect)
+
+
+def box_iou(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def in_region(box, size, region):
+    (height, width) = size[:2]
+    center_x = (box[0] + box[2]) / 2.0 / width
+    center_y = (box[1] + box[3]) / 2.0 / height
+    return region[0] <= center_x <= region[2] and region[1] <= center_y <= region[3]
+
+
+# Pick the driver among the faces found in a frame of `size` (its shape).
+# The face overlapping the previous driver box is kept when there is one,
+# otherwise the largest face (inside the seat region, when given). A lone
+# face is always the same driver, wherever it moved to: a drowsy head
+# dropping or the driver coming back into view after a moment is not
+# someone else. Holds no state, so it can run on any inference worker.
+# Returns (index or None, whether it is the same face as the previous
+# driver).
+def select_driver(rects, size, previous=None, region=DRIVER_REGION, min_iou=MIN_DRIVER_IOU):
+    boxes = [as_box(rect) for rect in rects]
+    candidates = [i for i, box in enumerate(boxes) if region is None or in_region(box, size, region)]
+    if not candidates:
+        return None, False
+
+    if previous is not None:
+        best = max(candidates, key=lambda i: box_iou(boxes[i], previous))
+        if box_iou(boxes[best], previous) >= min_iou or len(candidates) == 1:
+            return best, True
+
+    largest = max(candidates, key=lambda i: (boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1]))
+    return largest, False
+
+
+# Driver identity across frames. `box` is the driver's last known face box;
+# it is kept through frames without a face, so a driver who looks away
+# keeps their identity when they look back. driver_id goes up every time a
+# different face becomes the driver, which takes change_frames frames in
+# a row of that face being picked; until then `box` stays the previous
+# driver's.
+class DriverSelector:
+    def __init__(self, region=DRIVER_REGION, min_iou=MIN_DRIVER_IOU, change_frames=DRIVER_CHANGE_FRAMES):
+        self.region = region
+        self.min_iou = min_iou
+        self.change_frames = change_frames
+        self.box = None
+        self.driver_id = 0
+        self._candidate = None  # (box, frames) of a face that may be taking over
+
+    # Record the driver picked by select_driver; returns True when it is a
+    # different person from the previous driver
+    def update(self, box, same_driver):
+        box = tuple(box)
+        if self.box is None or same_driver:
+            if self.box is None:
+                self.driver_id += 1
+            self.box = box
+            self._candidate = None
+            return False
+
+        frames = 1
+        if self._candidate is not None and box_iou(box, self._candidate[0]) >= self.min_iou:
+            frames = self._candidate[1] + 1
+        if frames < self.change_frames:
+            self._candidate = (box, frames)
+            return False
+        self.driver_id += 1
+        self.box = box
+        self._candidate = None
+        return True
+
+    # Select the driver among `rects` and update the identity. Returns
+    # (index or None, whether the driver changed).
+    def select(self, rects, size):
+        index, same_driver = select_driver(rects, size, self.box, self.region, self.min_iou)
+        if index is None:
+            return None, False
+        return index, self.update(as_box(rects[index]), same_driver)
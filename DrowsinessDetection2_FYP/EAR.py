@@ -1,14 +1,32 @@
-from scipy.spatial import distance as dist
+import numpy as np
 
-def eye_aspect_ratio(eye):
+# 68-point landmark ranges of each eye (same as face_utils.FACIAL_LANDMARKS_IDXS)
+LEFT_EYE = slice(42, 48)
+RIGHT_EYE = slice(36, 42)
+
+
+def eye_aspect_ratios(eyes):
+    # eyes is an (..., 6, 2) array of eye landmarks, e.g. (N, 6, 2) for
+    # N eyes; returns an (...) array of aspect ratios
+    eyes = np.asarray(eyes, dtype="double")
     # compute the euclidean distances between the two sets of
     # vertical eye landmarks (x, y)-coordinates
-    A = dist.euclidean(eye[1], eye[5])
-    B = dist.euclidean(eye[2], eye[4])
+    A = np.linalg.norm(eyes[..., 1, :] - eyes[..., 5, :], axis=-1)
+    B = np.linalg.norm(eyes[..., 2, :] - eyes[..., 4, :], axis=-1)
     # compute the euclidean distance between the horizontal
     # eye landmark (x, y)-coordinates
-    C = dist.euclidean(eye[0], eye[3])
+    C = np.linalg.norm(eyes[..., 0, :] - eyes[..., 3, :], axis=-1)
     # compute the eye aspect ratio
-    ear = (A + B) / (2.0 * C)
-    # return the eye aspect ratio
-    return ear
\ No newline at end of file
+    return (A + B) / (2.0 * C)
+
+
+def face_eye_aspect_ratios(shapes):
+    # shapes is an (N, 68, 2) stack of landmarks (N faces or N frames);
+    # returns the EAR averaged over both eyes for each of them
+    shapes = np.asarray(shapes, dtype="double")
+    return (eye_aspect_ratios(shapes[..., LEFT_EYE, :]) + eye_aspect_ratios(shapes[..., RIGHT_EYE, :])) / 2.0
+
+
+def eye_aspect_ratio(eye):
+    # return the eye aspect ratio of a single (6, 2) eye
+    return float(eye_aspect_ratios(eye))
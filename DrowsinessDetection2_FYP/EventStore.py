@@ -0,0 +1,254 @@
+import math
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+
+# SQLite database trip history is written to; empty disables it
+EVENT_DB_PATH = os.environ.get("DROWSINESS_EVENT_DB", "events.db")
+
+# Seconds between the EAR/MOR samples kept per session; alerts are always
+# kept
+EVENT_SAMPLE_INTERVAL = float(os.environ.get("DROWSINESS_EVENT_SAMPLE_INTERVAL", 1.0))
+
+# How often the writer thread flushes the buffer, and how many events the
+# buffer holds before new ones are dropped
+EVENT_FLUSH_INTERVAL = float(os.environ.get("DROWSINESS_EVENT_FLUSH_INTERVAL", 1.0))
+MAX_BUFFERED_EVENTS = int(os.environ.get("DROWSINESS_MAX_BUFFERED_EVENTS", 100000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    session_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    ear REAL,
+    mor REAL
+);
+CREATE INDEX IF NOT EXISTS samples_session ON samples (session_id, timestamp);
+CREATE TABLE IF NOT EXISTS alerts (
+    session_id TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alerts_session ON alerts (session_id, timestamp);
+CREATE TABLE IF NOT EXISTS trips (
+    session_id TEXT PRIMARY KEY,
+    started_at REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    frames INTEGER NOT NULL DEFAULT 0,
+    face_samples INTEGER NOT NULL DEFAULT 0,
+    ear_sum REAL NOT NULL DEFAULT 0,
+    mor_sum REAL NOT NULL DEFAULT 0,
+    min_ear REAL,
+    max_mor REAL,
+    eyes_closed_alerts INTEGER NOT NULL DEFAULT 0,
+    mouth_open_alerts INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Adds one flush's totals for a trip to its row
+UPDATE_TRIP = """
+INSERT INTO trips (session_id, started_at, last_seen, frames, face_samples, ear_sum, mor_sum, min_ear, max_mor,
+                   eyes_closed_alerts, mouth_open_alerts)
+VALUES (:session_id, :started_at, :last_seen, :frames, :face_samples, :ear_sum, :mor_sum, :min_ear, :max_mor,
+        :eyes_closed_alerts, :mouth_open_alerts)
+ON CONFLICT (session_id) DO UPDATE SET
+    started_at = min(started_at, excluded.started_at),
+    last_seen = max(last_seen, excluded.last_seen),
+    frames = frames + excluded.frames,
+    face_samples = face_samples + excluded.face_samples,
+    ear_sum = ear_sum + excluded.ear_sum,
+    mor_sum = mor_sum + excluded.mor_sum,
+    min_ear = coalesce(min(min_ear, excluded.min_ear), min_ear, excluded.min_ear),
+    max_mor = coalesce(max(max_mor, excluded.max_mor), max_mor, excluded.max_mor),
+    eyes_closed_alerts = eyes_closed_alerts + excluded.eyes_closed_alerts,
+    mouth_open_alerts = mouth_open_alerts + excluded.mouth_open_alerts
+"""
+
+
+# Whether an event can be stored: a finite timestamp and, for samples,
+# finite EAR/MOR when there are any
+def valid_event(event):
+    values = [event[2]]
+    if event[0] == "sample":
+        values += [v for v in event[3:5] if v is not None]
+    return all(isinstance(v, (int, float)) and math.isfinite(v) for v in values)
+
+
+# Per-trip summary from a trips row
+def trip_summary(row):
+    (session_id, started_at, last_seen, frames, face_samples, ear_sum, mor_sum, min_ear, max_mor,
+     eyes_closed_alerts, mouth_open_alerts) = row
+    return {
+        "session_id": session_id,
+        "started_at": started_at,
+        "last_seen": last_seen,
+        "duration": last_seen - started_at,
+        "frames": frames,
+        "mean_ear": ear_sum / face_samples if face_samples else None,
+        "mean_mor": mor_sum / face_samples if face_samples else None,
+        "min_ear": min_ear,
+        "max_mor": max_mor,
+        "eyes_closed_alerts": eyes_closed_alerts,
+        "mouth_open_alerts": mouth_open_alerts,
+        "alerts": eyes_closed_alerts + mouth_open_alerts,
+    }
+
+
+# Trip history: EAR/MOR samples and alerts per session (one session per
+# trip), plus a running summary row per trip. Callers only append to an
+# in-memory buffer; a writer thread flushes it to SQLite (in WAL mode, so
+# summaries can be read while it writes) in one transaction per flush and
+# folds each flush into the trip rows, so summaries never scan the samples.
+# Events that cannot be stored are dropped; a flush that fails puts its
+# events back in the buffer for the next one. on_drop(count) is called for
+# every event lost either way.
+class EventStore:
+    def __init__(self, path=EVENT_DB_PATH, flush_interval=EVENT_FLUSH_INTERVAL, max_buffered=MAX_BUFFERED_EVENTS,
+                 on_drop=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+        self.on_drop = on_drop
+        self._buffer = deque()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        finally:
+            db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    @property
+    def pending(self):
+        return len(self._buffer)
+
+    # Buffer an event; returns False when the buffer is full and the event
+    # was dropped. frames is how many frames the sample stands for.
+    def _append(self, event):
+        if len(self._buffer) >= self.max_buffered:
+            return False
+        self._buffer.append(event)
+        return True
+
+    def sample(self, session_id, timestamp, ear, mor, frames=1):
+        return self._append(("sample", session_id, timestamp, ear, mor, frames))
+
+    def alert(self, session_id, timestamp, event_type):
+        return self._append(("alert", session_id, timestamp, event_type))
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="event-store", daemon=True)
+            self._thread.start()
+
+    # Stop the writer thread after a last flush
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                print("[ERROR] Unable to write trip events, will retry: {}".format(e), file=sys.stderr)
+
+    def _dropped(self, count):
+        if count and self.on_drop is not None:
+            self.on_drop(count)
+
+    # Write everything buffered so far; returns the number of events written
+    def flush(self):
+        with self._flush_lock:
+            events = []
+            while self._buffer:
+                events.append(self._buffer.popleft())
+            if not events:
+                return 0
+            valid = [event for event in events if valid_event(event)]
+            self._dropped(len(events) - len(valid))
+
+            samples, alerts, trips = [], [], {}
+            for event in valid:
+                session_id, timestamp = event[1], event[2]
+                trip = trips.get(session_id)
+                if trip is None:
+                    trip = trips[session_id] = {
+                        "session_id": session_id, "started_at": timestamp, "last_seen": timestamp, "frames": 0,
+                        "face_samples": 0, "ear_sum": 0.0, "mor_sum": 0.0, "min_ear": None, "max_mor": None,
+                        "eyes_closed_alerts": 0, "mouth_open_alerts": 0}
+                trip["started_at"] = min(trip["started_at"], timestamp)
+                trip["last_seen"] = max(trip["last_seen"], timestamp)
+
+                if event[0] == "alert":
+                    alerts.append(event[1:])
+                    key = event[3] + "_alerts"
+                    if key in trip:
+                        trip[key] += 1
+                    continue
+
+                (_, _, _, ear, mor, frames) = event
+                samples.append((session_id, timestamp, ear, mor))
+                trip["frames"] += frames
+                if ear is not None:
+                    trip["face_samples"] += 1
+                    trip["ear_sum"] += ear
+                    trip["mor_sum"] += mor
+                    trip["min_ear"] = ear if trip["min_ear"] is None else min(trip["min_ear"], ear)
+                    trip["max_mor"] = mor if trip["max_mor"] is None else max(trip["max_mor"], mor)
+
+            try:
+                db = self._connect()
+                try:
+                    with db:
+                        db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?)", samples)
+                        db.executemany("INSERT INTO alerts VALUES (?, ?, ?)", alerts)
+                        db.executemany(UPDATE_TRIP, list(trips.values()))
+                finally:
+                    db.close()
+            except sqlite3.Error:
+                # Back to the front of the buffer, ahead of anything added
+                # since, keeping the newest events when it overflows
+                self._buffer.extendleft(reversed(valid))
+                overflow = 0
+                while len(self._buffer) > self.max_buffered:
+                    self._buffer.popleft()
+                    overflow += 1
+                self._dropped(overflow)
+                raise
+            return len(valid)
+
+    # Summary of one trip, or None if nothing was recorded for it yet
+    def trip(self, session_id):
+        db = self._connect()
+        try:
+            row = db.execute("SELECT * FROM trips WHERE session_id = ?", (session_id,)).fetchone()
+        finally:
+            db.close()
+        return trip_summary(row) if row is not None else None
+
+    # Summaries of the trips whose session id starts with `prefix` (e.g. a
+    # user id), most recent first
+    def trips(self, prefix="", limit=50):
+        pattern = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT * FROM trips WHERE session_id LIKE ? ESCAPE '\\' "
+                              "ORDER BY last_seen DESC LIMIT ?", (pattern, limit)).fetchall()
+        finally:
+            db.close()
+        return [trip_summary(row) for row in rows]
+
@@ -0,0 +1,78 @@
+import os
+import dlib
+import numpy as np
+
+# Clients may upload just the driver's face instead of the whole frame:
+# the server answers every frame with a crop_box (the driver's face box
+# padded by CROP_MARGIN of its size on each side, in frame coordinates),
+# the client cuts that region out of its next frame and sends it along
+# with the box. Only the landmark model runs on a crop; the face rectangle
+# is taken from the box rather than detected.
+CROP_MARGIN = float(os.environ.get("DROWSINESS_CROP_MARGIN", 0.3))
+
+# Landmarks are only trusted when the outer eye corners are this far apart,
+# as a fraction of the face rectangle's width, and the eyes sit above the
+# mouth. Otherwise the face is not where the crop says and it is searched
+# for in the crop instead.
+EYE_DISTANCE_RANGE = (0.3, 0.8)
+
+
+# Parse a box given as "left,top,right,bottom" pixels
+def parse_box(text):
+    box = tuple(int(round(float(v))) for v in text.split(","))
+    if len(box) != 4 or box[0] < 0 or box[1] < 0 or box[2] <= box[0] or box[3] <= box[1]:
+        raise ValueError("box must be left,top,right,bottom pixels, got {!r}".format(text))
+    return box
+
+
+# The region a client should crop around `face_box` for its next frame,
+# clipped to the frame when its size (width, height) is known
+def crop_box_for(face_box, frame_size=None, margin=CROP_MARGIN):
+    (left, top, right, bottom) = face_box
+    pad_x = int((right - left) * margin)
+    pad_y = int((bottom - top) * margin)
+    (left, top, right, bottom) = (max(left - pad_x, 0), max(top - pad_y, 0), right + pad_x, bottom + pad_y)
+    if frame_size is not None:
+        right, bottom = min(right, frame_size[0]), min(bottom, frame_size[1])
+    return [left, top, right, bottom]
+
+
+# Face rectangle within a crop image of `size` (its shape) cut from
+# `crop_box` of the frame: the previous face box moved into the crop when
+# it lies inside it, otherwise the crop without the margin crop_box_for
+# added around the face
+def face_rect_in_crop(size, crop_box, previous_box=None, margin=CROP_MARGIN):
+    (height, width) = size[:2]
+    (left, top, right, bottom) = crop_box
+    scale_x = width / float(right - left)
+    scale_y = height / float(bottom - top)
+
+    if previous_box is not None:
+        (x0, y0, x1, y1) = previous_box
+        if left <= (x0 + x1) / 2.0 <= right and top <= (y0 + y1) / 2.0 <= bottom:
+            x0, x1 = max(int((x0 - left) * scale_x), 0), min(int((x1 - left) * scale_x), width - 1)
+            y0, y1 = max(int((y0 - top) * scale_y), 0), min(int((y1 - top) * scale_y), height - 1)
+            if x1 > x0 and y1 > y0:
+                return dlib.rectangle(x0, y0, x1, y1)
+
+    inset = margin / (1 + 2 * margin)
+    return dlib.rectangle(int(width * inset), int(height * inset),
+                          int(width * (1 - inset)) - 1, int(height * (1 - inset)) - 1)
+
+
+# Map a rectangle in the crop image back to frame coordinates
+def crop_rect_to_frame(rect, size, crop_box):
+    (height, width) = size[:2]
+    (left, top, right, bottom) = crop_box
+    scale_x = (right - left) / float(width)
+    scale_y = (bottom - top) / float(height)
+    return [int(round(left + rect.left() * scale_x)), int(round(top + rect.top() * scale_y)),
+            int(round(left + rect.right() * scale_x)), int(round(top + rect.bottom() * scale_y))]
+
+
+# Whether 68 point layout landmarks look like a face in `rect`
+def plausible_landmarks(shape, rect):
+    eye_distance = np.linalg.norm(shape[45] - shape[36]) / max(rect.width(), 1)
+    eyes_y = shape[36:48, 1].mean()
+    mouth_y = shape[48:68, 1].mean()
+    return EYE_DISTANCE_RANGE[0] <= eye_distance <= EYE_DISTANCE_RANGE[1] and eyes_y < mouth_y
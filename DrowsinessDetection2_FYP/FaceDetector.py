@@ -0,0 +1,30 @@
+import cv2
+import dlib
+
+# Default detection scale: 1.0 detects on the full frame, 0.5 on a half
+# resolution copy, 0.25 on a quarter resolution copy
+DETECTION_SCALE = 1.0
+
+
+# Runs the face detector on a downscaled copy of the frame and maps the
+# rectangles back to full resolution, so shape_predictor can still work on
+# the full resolution frame and EAR/MOR keep their precision. Faces must be
+# about 80/scale pixels wide to be found without upsampling.
+class ScaledDetector:
+    def __init__(self, detector, scale=DETECTION_SCALE):
+        if not 0 < scale <= 1:
+            raise ValueError("detection scale must be in (0, 1], got {}".format(scale))
+        self.detector = detector
+        self.scale = scale
+
+    def __call__(self, gray, upsample=0):
+        if self.scale == 1:
+            return self.detector(gray, upsample)
+
+        small = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return [scale_rect(rect, 1.0 / self.scale) for rect in self.detector(small, upsample)]
+
+
+def scale_rect(rect, factor):
+    return dlib.rectangle(int(round(rect.left() * factor)), int(round(rect.top() * factor)),
+                          int(round(rect.right() * factor)), int(round(rect.bottom() * factor)))
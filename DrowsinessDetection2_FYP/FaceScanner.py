@@ -1,49 +1,52 @@
-from scipy.spatial import distance as dist
 from imutils.video import VideoStream
 from imutils import face_utils
+import argparse
 import imutils
 import time
-import dlib
 import cv2
 import numpy as np
 from EAR import eye_aspect_ratio
 from MOR import mouth_opening_ratio
 from HeadPose import getHeadTiltAndCoords
-
-# Initialize dlib's face detector (HOG-based) and then create the
-# facial landmark predictor
-print("[INFO] loading facial landmark predictor...")
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
-
-# Initialize the video stream and sleep for a bit, allowing the
-# camera sensor to warm up
-print("[INFO] initializing camera...")
-vs = VideoStream(src=0).start()
-time.sleep(2.0)
+from FaceTracker import FaceTracker
+from FaceDetector import ScaledDetector, DETECTION_SCALE
+from LandmarkBackend import get_backend
+from DriverSelector import select_driver
+from Calibration import Calibrator, calibrations, CALIBRATION_SECONDS
+
+# Models and camera are set up by main(), so importing this module has no
+# side effects
+detector = None
+backend = None
+vs = None
 
 # 400x225 to 1024x576
 frame_width = 1024
 frame_height = 576
 
 
-def process_frame(frame, gray, detector, predictor):
+# Returns the annotated frame and the driver's (largest face's) EAR and
+# MOR, or None for both when there is no face
+def process_frame(frame, gray, detector, backend):
     rects = detector(gray, 0)
     if len(rects) > 0:
         text = "{} face(s) found".format(len(rects))
         cv2.putText(frame, text, (10, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
 
-    for rect in rects:
-        (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
-        cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (0, 255, 0), 1)
-        shape = predictor(gray, rect)
-        shape = face_utils.shape_to_np(shape)
+    driver, _ = select_driver(rects, gray.shape)
+    if driver is None:
+        return frame, None, None
 
-        process_landmarks(frame, shape)
-        process_eyes(frame, shape)
-        process_mouth(frame, shape)
+    rect = rects[driver]
+    shape = backend.landmarks(gray, [rect])[0]
+    (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
+    cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (0, 255, 0), 1)
 
-    return frame
+    if backend.head_pose:
+        process_landmarks(frame, shape)
+    ear = process_eyes(frame, shape)
+    mor = process_mouth(frame, shape)
+    return frame, ear, mor
 
 
 def process_landmarks(frame, shape):
@@ -85,6 +88,7 @@ def process_eyes(frame, shape):
     rightEyeHull = cv2.convexHull(rightEye)
     cv2.drawContours(frame, [leftEyeHull], -1, (0, 255, 0), 1)
     cv2.drawContours(frame, [rightEyeHull], -1, (0, 255, 0), 1)
+    return ear
 
 
 def process_mouth(frame, shape):
@@ -93,55 +97,76 @@ def process_mouth(frame, shape):
     mor = mouth_opening_ratio(mouth)
     mouthHull = cv2.convexHull(mouth)
     cv2.drawContours(frame, [mouthHull], -1, (0, 255, 0), 1)
+    return mor
 
 
-def capture_state(message, duration=10):
+# Feed the camera stream to `calibrator` until it completes, without any
+# prompts: the driver just drives (or sits) normally. Returns the learned
+# thresholds, or None if "q" was pressed first.
+def capture_state(calibrator, message):
     print(message)
-    input("[INFO] Press Enter to start capturing...")
-    end_time = time.time() + duration
-
-    ear_values = []
-    mor_values = []
-
-    while time.time() < end_time:
+    while not calibrator.done:
         frame = vs.read()
+        captured_at = time.time()
         frame = imutils.resize(frame, width=frame_width, height=frame_height)
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        frame = process_frame(frame, gray, detector, predictor)
+        frame, ear, mor = process_frame(frame, gray, detector, backend)
+        if ear is not None:
+            calibrator.add(captured_at, ear, mor)
 
-        cv2.putText(frame, message, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        cv2.putText(frame, "Calibrating... {} frames".format(calibrator.ear.count), (10, 30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
         cv2.imshow("Frame", frame)
         key = cv2.waitKey(1) & 0xFF
 
         if key == ord("q"):
             break
 
-    avg_ear = np.mean(ear_values)
-    avg_mor = np.mean(mor_values)
+    return calibrator.thresholds
 
-    return avg_ear, avg_mor
 
+def capture_thresholds(duration=CALIBRATION_SECONDS):
+    return capture_state(Calibrator(duration),
+                         "[INFO] Calibrating over {:g} seconds, keep driving normally...".format(duration))
 
-def capture_thresholds():
-    eye_open, mouth_closed = capture_state("[INFO] Please keep your eyes open and mouth closed for 10 seconds.")
-    eye_closed, mouth_closed_2 = capture_state("[INFO] Please keep your eyes closed and mouth closed for 10 seconds.")
-    eye_open_2, mouth_open = capture_state("[INFO] Please keep your eyes open and mouth open for 10 seconds.")
 
-    eye_ar_thresh = (eye_open + eye_closed) / 2.0
-    mouth_ar_thresh = (mouth_open + mouth_closed) / 2.0
+def initialize():
+    global detector, backend, vs
+    # Initialize the landmark backend's face detector and landmark model
+    # (dlib HOG + 68 point predictor unless DROWSINESS_LANDMARK_BACKEND
+    # says otherwise). Faces are tracked between periodic full detections.
+    backend = get_backend()
+    detector = FaceTracker(ScaledDetector(backend.detector(), DETECTION_SCALE))
 
-    return eye_ar_thresh, mouth_ar_thresh
+    # Initialize the video stream and sleep for a bit, allowing the
+    # camera sensor to warm up
+    print("[INFO] initializing camera...")
+    vs = VideoStream(src=0).start()
+    time.sleep(2.0)
 
 
-def main():
-    eye_ar_thresh, mouth_ar_thresh = capture_thresholds()
-    print("[INFO] Eye aspect ratio threshold: {:.2f}".format(eye_ar_thresh))
-    print("[INFO] Mouth aspect ratio threshold: {:.2f}".format(mouth_ar_thresh))
-
+# Learn a driver's thresholds ahead of time and save them where the
+# detector and the server load them from
+def main(driver_id, duration):
+    initialize()
+    thresholds = capture_thresholds(duration)
     cv2.destroyAllWindows()
     vs.stop()
 
+    if thresholds is None:
+        print("[INFO] Calibration stopped, nothing saved")
+        return
+    calibrations.put(driver_id, thresholds)
+    print("[INFO] Eye aspect ratio threshold: {:.2f}".format(thresholds["eye_thresh"]))
+    print("[INFO] Mouth aspect ratio threshold: {:.2f}".format(thresholds["mouth_thresh"]))
+    print("[INFO] Saved for {} in {}".format(driver_id, calibrations.path))
+
 
 if __name__ == "__main__":
-    main()
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--driver-id", default="default", help="driver to save the thresholds for")
+    ap.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS,
+                    help="seconds of normal driving to calibrate on")
+    args = vars(ap.parse_args())
+    main(args["driver_id"], args["seconds"])
@@ -0,0 +1,75 @@
+import dlib
+import numpy as np
+
+# Full HOG detection runs at least this often, in frames
+REDETECT_INTERVAL = 10
+
+# Correlation tracker peak-to-sidelobe ratio below which we stop trusting it
+MIN_TRACK_CONFIDENCE = 7.0
+
+# How far around a previous face box to search, as a fraction of its size
+ROI_MARGIN = 0.5
+
+
+# Follows faces between frames with dlib's correlation tracker so the HOG
+# detector only has to run every `redetect_interval` frames, or sooner when
+# a tracker loses confidence. Called like the detector it wraps, so it can
+# be passed to process_frame in its place.
+class FaceTracker:
+    def __init__(self, detector, redetect_interval=REDETECT_INTERVAL, min_confidence=MIN_TRACK_CONFIDENCE):
+        self.detector = detector
+        self.redetect_interval = redetect_interval
+        self.min_confidence = min_confidence
+        self._trackers = []
+        self._frames_since_detection = 0
+
+    def __call__(self, gray, upsample=0):
+        if not self._trackers or self._frames_since_detection >= self.redetect_interval:
+            return self._detect(gray, upsample)
+
+        rects = []
+        for tracker in self._trackers:
+            if tracker.update(gray) < self.min_confidence:
+                return self._detect(gray, upsample)
+            rects.append(to_rectangle(tracker.get_position()))
+        self._frames_since_detection += 1
+        return rects
+
+    def _detect(self, gray, upsample):
+        rects = self.detector(gray, upsample)
+        self._trackers = []
+        for rect in rects:
+            tracker = dlib.correlation_tracker()
+            tracker.start_track(gray, rect)
+            self._trackers.append(tracker)
+        self._frames_since_detection = 0
+        return list(rects)
+
+
+def to_rectangle(drect):
+    return dlib.rectangle(int(round(drect.left())), int(round(drect.top())),
+                          int(round(drect.right())), int(round(drect.bottom())))
+
+
+# Stateless variant for the server, where consecutive frames of a session
+# may land on different workers: look for faces only in a window around
+# each previous face box (given as (left, top, right, bottom)) and fall back
+# to the full frame when none are found there.
+# Returns the rects and whether full-frame detection ran.
+def detect_faces(detector, gray, previous_rects=None, margin=ROI_MARGIN):
+    if previous_rects:
+        rects = []
+        height, width = gray.shape[:2]
+        for (left, top, right, bottom) in previous_rects:
+            pad_x = int((right - left) * margin)
+            pad_y = int((bottom - top) * margin)
+            x0, y0 = max(left - pad_x, 0), max(top - pad_y, 0)
+            x1, y1 = min(right + pad_x, width), min(bottom + pad_y, height)
+            if x1 <= x0 or y1 <= y0:
+                continue
+            for rect in detector(np.ascontiguousarray(gray[y0:y1, x0:x1]), 0):
+                rects.append(dlib.rectangle(rect.left() + x0, rect.top() + y0,
+                                            rect.right() + x0, rect.bottom() + y0))
+        if rects:
+            return rects, False
+    return list(detector(gray, 0)), True
@@ -0,0 +1,84 @@
+import os
+import cv2
+import numpy as np
+
+# Frames whose driver eye and mouth regions differ from the last analyzed
+# frame's by less than this (largest absolute difference between small
+# grayscale thumbnails of the regions, in gray levels 0-255) reuse that
+# frame's landmarks and ratios instead of running detection and landmarks
+# again. The alert timers still advance on every frame. 0, the default,
+# analyzes every frame; the threshold has not been validated on real
+# driving footage yet.
+CHANGE_THRESHOLD = float(os.environ.get("DROWSINESS_CHANGE_THRESHOLD", 0.0))
+
+# Frames in a row that may reuse an analysis before one is forced, so a
+# face that drifts very slowly is still looked at
+MAX_REUSED_FRAMES = int(os.environ.get("DROWSINESS_MAX_REUSED_FRAMES", 10))
+
+# Landmark ranges, in the 68 point layout, of the regions compared: left
+# eye, right eye and mouth
+REGION_POINTS = ((36, 42), (42, 48), (48, 68))
+
+# Padding around each region's landmarks, as a fraction of the region's
+# width, so the eyelids and lips stay inside the box as they move
+REGION_MARGIN = 0.5
+
+# Side of the square thumbnail each region is compared at, in pixels
+THUMBNAIL_SIZE = 16
+
+
+# Downsampled region: `box` (left, top, right, bottom) of a grayscale
+# frame, or None when the box is not inside the frame
+def roi_thumbnail(gray, box):
+    (height, width) = gray.shape[:2]
+    (left, top, right, bottom) = (max(int(box[0]), 0), max(int(box[1]), 0),
+                                  min(int(box[2]), width), min(int(box[3]), height))
+    if right - left < 2 or bottom - top < 2:
+        return None
+    return cv2.resize(gray[top:bottom, left:right], (THUMBNAIL_SIZE, THUMBNAIL_SIZE), interpolation=cv2.INTER_AREA)
+
+
+# Boxes of the eye and mouth regions around 68 point landmarks
+def landmark_regions(shape, margin=REGION_MARGIN):
+    boxes = []
+    for (start, end) in REGION_POINTS:
+        points = np.asarray(shape[start:end])
+        (left, top), (right, bottom) = points.min(axis=0), points.max(axis=0)
+        pad = margin * (right - left)
+        boxes.append([int(left - pad), int(top - pad), int(right + pad), int(bottom + pad)])
+    return boxes
+
+
+# Reference a later frame is compared against: (box, thumbnail) of each
+# eye and mouth region of `gray` around its landmarks, or None when one is
+# not inside the frame
+def region_reference(gray, shape):
+    reference = []
+    for box in landmark_regions(shape):
+        thumbnail = roi_thumbnail(gray, box)
+        if thumbnail is None:
+            return None
+        reference.append((box, thumbnail))
+    return reference
+
+
+# Largest absolute difference between any pixel of two thumbnails, in gray
+# levels
+def thumbnail_change(a, b):
+    return float(cv2.absdiff(a, b).max())
+
+
+# Whether `gray` is close enough to the reference regions of the last
+# analyzed frame to reuse its analysis: every region must have changed by
+# less than the threshold. Returns (unchanged, change), change being the
+# largest change of any region.
+def is_unchanged(gray, reference, threshold=CHANGE_THRESHOLD):
+    if reference is None or threshold <= 0:
+        return False, None
+    change = 0.0
+    for (box, thumbnail) in reference:
+        current = roi_thumbnail(gray, box)
+        if current is None:
+            return False, None
+        change = max(change, thumbnail_change(current, np.asarray(thumbnail, dtype=np.uint8)))
+    return change < threshold, change
@@ -0,0 +1,82 @@
+import os
+
+# Interval, in seconds, a client is told to wait before its next frame.
+# While the driver is clearly alert the interval grows step by step up to
+# MAX_FRAME_INTERVAL; as soon as a timer is running, or EAR/MOR are near or
+# heading for their thresholds, it drops straight to MIN_FRAME_INTERVAL so
+# the timers see every frame they need. The start of an eye closure is seen
+# at most one interval late, and the timers measure from that frame.
+MIN_FRAME_INTERVAL = float(os.environ.get("DROWSINESS_MIN_FRAME_INTERVAL", 0.2))
+MAX_FRAME_INTERVAL = float(os.environ.get("DROWSINESS_MAX_FRAME_INTERVAL", 1.0))
+
+# Used while there is no driver in view or their thresholds are still being
+# calibrated, the cadence clients used before
+BASE_FRAME_INTERVAL = 0.5
+
+# Growth of the interval per alert frame
+FRAME_INTERVAL_STEP = 1.25
+
+# EAR within this fraction above the eye threshold (MOR below the mouth
+# threshold) counts as near it
+NEAR_THRESHOLD_FRACTION = 0.15
+
+# Weight of the newest frame in the smoothed EAR/MOR the trend is taken from
+TREND_SMOOTHING = 0.5
+
+
+# Whether EAR/MOR are past or within NEAR_THRESHOLD_FRACTION of the eye and
+# mouth thresholds
+def near_thresholds(ear, mor, eye_thresh, mouth_thresh):
+    return ear <= eye_thresh * (1 + NEAR_THRESHOLD_FRACTION) or mor >= mouth_thresh * (1 - NEAR_THRESHOLD_FRACTION)
+
+
+# Recommended next-frame interval for one driver's stream
+class FramePacer:
+    def __init__(self, min_interval=MIN_FRAME_INTERVAL, max_interval=MAX_FRAME_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.base_interval = min(max(BASE_FRAME_INTERVAL, self.min_interval), self.max_interval)
+        self.interval = self.base_interval
+        self.at_risk = False  # Whether the last frame had a timer running or was at risk
+        self._last = None  # (timestamp, smoothed EAR, smoothed MOR)
+
+    def reset(self):
+        self.interval = self.base_interval
+        self.at_risk = False
+        self._last = None
+
+    # Whether the driver's smoothed EAR/MOR are near their thresholds or, at
+    # their current rate of change, will reach them within max_interval
+    def _at_risk(self, timestamp, ear, mor, state):
+        ear_rate = mor_rate = 0.0
+        smoothed_ear, smoothed_mor = ear, mor
+        if self._last is not None and timestamp > self._last[0]:
+            last_time, last_ear, last_mor = self._last
+            smoothed_ear = last_ear + TREND_SMOOTHING * (ear - last_ear)
+            smoothed_mor = last_mor + TREND_SMOOTHING * (mor - last_mor)
+            ear_rate = (smoothed_ear - last_ear) / (timestamp - last_time)
+            mor_rate = (smoothed_mor - last_mor) / (timestamp - last_time)
+        if self._last is None or timestamp > self._last[0]:
+            self._last = (timestamp, smoothed_ear, smoothed_mor)
+
+        projected_ear = smoothed_ear + min(ear_rate, 0.0) * self.max_interval
+        projected_mor = smoothed_mor + max(mor_rate, 0.0) * self.max_interval
+        return near_thresholds(projected_ear, projected_mor, state.eye_thresh, state.mouth_thresh)
+
+    # Update with a scored frame (ear/mor None when no driver was found) and
+    # the session's DrowsinessState after it; returns the interval
+    def update(self, timestamp, state, ear, mor, calibrating=False):
+        if ear is None or mor is None:
+            self.reset()
+            return self.interval
+
+        at_risk = self._at_risk(timestamp, ear, mor, state)
+        timers_running = state.eyes.start_time is not None or state.mouth.start_time is not None
+        self.at_risk = timers_running or at_risk
+        if self.at_risk:
+            self.interval = self.min_interval
+        elif calibrating:
+            self.interval = self.base_interval
+        else:
+            self.interval = min(self.interval * FRAME_INTERVAL_STEP, self.max_interval)
+        return self.interval
@@ -1,6 +1,7 @@
 import numpy as np
 import math
 import cv2
+from collections import namedtuple
 
 # 3D model points.
 model_points = np.array([
@@ -26,6 +27,12 @@ def isRotationMatrix(R):
 # of the euler angles ( x and z are swapped ).
 def rotationMatrixToEulerAngles(R):
     assert(isRotationMatrix(R))
+    return eulerAngles(R)
+
+
+# Same as rotationMatrixToEulerAngles without the validity check, for
+# matrices that come straight out of cv2.Rodrigues
+def eulerAngles(R):
     sy = math.sqrt(R[0, 0] * R[0, 0] + R[1, 0] * R[1, 0])
     singular = sy < 1e-6
     if not singular:
@@ -73,3 +80,69 @@ def getHeadTiltAndCoords(size, image_points, frame_height):
     ending_point_alternate = (ending_point[0], frame_height // 2)
 
     return head_tilt_degree, starting_point, ending_point, ending_point_alternate
+
+
+# Angles are in degrees: pitch is the nod (x axis), yaw the turn (y axis)
+# and roll the side tilt (z axis). head_tilt matches getHeadTiltAndCoords.
+# The drawing points are None when projection was skipped.
+HeadPoseResult = namedtuple("HeadPoseResult", ["head_tilt", "pitch", "yaw", "roll",
+                                               "start_point", "end_point", "end_point_alt"])
+
+
+# Stateful replacement for getHeadTiltAndCoords, one per video stream.
+# Camera intrinsics are cached per frame size and solvePnP is warm-started
+# from the previous frame's pose, which converges in fewer iterations and
+# keeps the solution from flipping between frames. Call reset() when the
+# face is lost so the next solve starts cold.
+class HeadPoseEstimator:
+    def __init__(self):
+        self.dist_coeffs = np.zeros((4, 1))  # Assuming no lens distortion
+        self._camera_matrices = {}
+        self.rotation_vector = None
+        self.translation_vector = None
+
+    def camera_matrix(self, size):
+        key = (size[0], size[1])
+        camera_matrix = self._camera_matrices.get(key)
+        if camera_matrix is None:
+            focal_length = size[1]
+            center = (size[1] / 2, size[0] / 2)
+            camera_matrix = np.array([[focal_length, 0, center[0]], [
+                0, focal_length, center[1]], [0, 0, 1]], dtype="double")
+            self._camera_matrices[key] = camera_matrix
+        return camera_matrix
+
+    def reset(self):
+        self.rotation_vector = None
+        self.translation_vector = None
+
+    def estimate(self, size, image_points, project=True):
+        camera_matrix = self.camera_matrix(size)
+        if self.rotation_vector is not None:
+            ok, rotation_vector, translation_vector = cv2.solvePnP(
+                model_points, image_points, camera_matrix, self.dist_coeffs,
+                self.rotation_vector.copy(), self.translation_vector.copy(),
+                useExtrinsicGuess=True, flags=cv2.SOLVEPNP_ITERATIVE)
+        else:
+            ok = False
+        if not ok:
+            ok, rotation_vector, translation_vector = cv2.solvePnP(
+                model_points, image_points, camera_matrix, self.dist_coeffs, flags=cv2.SOLVEPNP_ITERATIVE)
+        self.rotation_vector = rotation_vector
+        self.translation_vector = translation_vector
+
+        rotation_matrix, _ = cv2.Rodrigues(rotation_vector)
+        pitch, yaw, roll = np.rad2deg(eulerAngles(rotation_matrix))
+        head_tilt = abs(-180 - pitch)
+
+        start_point = end_point = end_point_alt = None
+        if project:
+            # Line sticking out of the nose, as drawn by the desktop detector
+            (nose_end_point2D, _) = cv2.projectPoints(np.array(
+                [(0.0, 0.0, 1000.0)]), rotation_vector, translation_vector, camera_matrix, self.dist_coeffs)
+            start_point = (int(image_points[0][0]), int(image_points[0][1]))
+            end_point = (int(nose_end_point2D[0][0][0]), int(nose_end_point2D[0][0][1]))
+            end_point_alt = (end_point[0], size[0] // 2)
+
+        return HeadPoseResult(float(head_tilt), float(pitch), float(yaw), float(roll),
+                              start_point, end_point, end_point_alt)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Times getHeadTiltAndCoords against HeadPoseEstimator on a synthetic head
+# motion sequence (the 3D model points projected through a slowly nodding
+# and turning pose, plus landmark noise), so no camera or model is needed.
+#
+#   python HeadPoseBenchmark.py --frames 5000
+import argparse
+import time
+import numpy as np
+import cv2
+from HeadPose import getHeadTiltAndCoords, HeadPoseEstimator, model_points
+
+frame_width = 1024
+frame_height = 576
+
+
+def synthetic_points(frames, noise, seed=0):
+    rng = np.random.default_rng(seed)
+    size = (frame_height, frame_width, 3)
+    camera_matrix = HeadPoseEstimator().camera_matrix(size)
+    t = np.arange(frames) / 30.0
+    sequence = []
+    for i in range(frames):
+        # Facing the camera, nodding +-15 degrees and turning +-20 degrees
+        rotation = np.deg2rad([180 + 15 * np.sin(t[i]), 20 * np.sin(0.5 * t[i]), 5 * np.sin(0.3 * t[i])])
+        rotation_vector, _ = cv2.Rodrigues(cv2.Rodrigues(np.array([rotation[0], 0.0, 0.0]))[0] @
+                                           cv2.Rodrigues(np.array([0.0, rotation[1], 0.0]))[0] @
+                                           cv2.Rodrigues(np.array([0.0, 0.0, rotation[2]]))[0])
+        translation_vector = np.array([[0.0], [0.0], [2500.0]])
+        points, _ = cv2.projectPoints(model_points, rotation_vector, translation_vector,
+                                      camera_matrix, np.zeros((4, 1)))
+        sequence.append(points.reshape(-1, 2) + rng.normal(0, noise, (6, 2)))
+    return size, sequence
+
+
+def time_per_frame(fn, sequence):
+    start = time.perf_counter()
+    results = [fn(points) for points in sequence]
+    return 1e6 * (time.perf_counter() - start) / len(sequence), results
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--frames", type=int, default=2000, help="number of synthetic frames")
+    ap.add_argument("--noise", type=float, default=1.0, help="landmark noise in pixels")
+    args = vars(ap.parse_args())
+
+    size, sequence = synthetic_points(args["frames"], args["noise"])
+
+    baseline_us, baseline = time_per_frame(
+        lambda points: getHeadTiltAndCoords(size, points, size[0])[0][0], sequence)
+    estimator = HeadPoseEstimator()
+    projected_us, _ = time_per_frame(lambda points: estimator.estimate(size, points).head_tilt, sequence)
+    estimator = HeadPoseEstimator()
+    estimate_us, estimated = time_per_frame(
+        lambda points: estimator.estimate(size, points, project=False).head_tilt, sequence)
+
+    # Tilt wraps around at 0/360 degrees when facing the camera
+    differences = np.abs(np.array(baseline) - np.array(estimated)) % 360
+    differences = np.minimum(differences, 360 - differences)
+    print("[INFO] {} frames, {:.1f} px landmark noise".format(len(sequence), args["noise"]))
+    print("{:<40} {:>10}".format("path", "us/frame"))
+    print("{:<40} {:>10.1f}".format("getHeadTiltAndCoords", baseline_us))
+    print("{:<40} {:>10.1f}".format("HeadPoseEstimator (with projection)", projected_us))
+    print("{:<40} {:>10.1f}".format("HeadPoseEstimator (no projection)", estimate_us))
+    print("[INFO] head tilt difference: mean {:.4f}, max {:.4f} degrees".format(
+        differences.mean(), differences.max()))
+
+
+if __name__ == "__main__":
+    main()
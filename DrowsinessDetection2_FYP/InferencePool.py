@@ -0,0 +1,58 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool already holds max_pending jobs."""
+
+
+# Bounded executor for CPU-bound inference jobs.
+# kind="process" scales across cores (each worker holds its own copy of the
+# dlib models, shared copy-on-write when forked); kind="thread" keeps
+# everything in one process. Jobs beyond max_pending are rejected instead of
+# queued so callers can shed load while latency stays bounded. A job that
+# scores several frames is charged `weight` (its frame count) against
+# max_pending; one heavier than max_pending is only taken by an idle pool.
+class InferencePool:
+    def __init__(self, kind="process", workers=None, max_pending=None, initializer=None):
+        if kind not in ("process", "thread"):
+            raise ValueError("pool kind must be 'process' or 'thread', got {!r}".format(kind))
+        self.kind = kind
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=initializer)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, initializer=initializer)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, fn, *args, weight=1):
+        weight = min(max(weight, 1), self.max_pending)
+        with self._lock:
+            if self._pending + weight > self.max_pending:
+                raise PoolSaturated("{} inference jobs already pending".format(self._pending))
+            self._pending += weight
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release(weight)
+            raise
+        future.add_done_callback(lambda _: self._release(weight))
+        return future
+
+    async def run(self, fn, *args, weight=1):
+        return await asyncio.wrap_future(self.submit(fn, *args, weight=weight))
+
+    def _release(self, weight):
+        with self._lock:
+            self._pending -= weight
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,160 @@
+import os
+import sys
+import threading
+import cv2
+import dlib
+import numpy as np
+from imutils import face_utils
+from ModelRegistry import get_model, get_detector, get_predictor, resolve_model_path
+
+# Face detector + landmark model pairs the pipelines can run on, selected
+# per deployment with DROWSINESS_LANDMARK_BACKEND (or --landmark-backend):
+#
+#   dlib68           dlib HOG detector + 68 point shape_predictor (default)
+#   dlib-eyes-mouth  dlib HOG detector + a shape_predictor trained on the
+#                    eye and mouth points only (36-67); smaller and faster,
+#                    but without the nose and chin points head pose needs.
+#                    The model does not ship with the repo; train it with
+#                    TrainEyeMouthModel.py
+#   lbf              OpenCV DNN (res10 SSD) face detector + cv2.face LBF
+#                    facemark, 68 points
+#
+# Every backend returns landmarks in dlib's 68 point layout, so EAR, MOR
+# and head pose read the same indices whatever produced them. Points a
+# backend does not provide are left at 0. The 5 point dlib model is not an
+# option: it only has two corners per eye and the nose, which is not enough
+# for EAR or MOR.
+LANDMARK_BACKEND = os.environ.get("DROWSINESS_LANDMARK_BACKEND", "dlib68")
+
+EYE_MOUTH_MODEL_PATH = os.environ.get("DROWSINESS_EYE_MOUTH_MODEL_PATH", "shape_predictor_eye_mouth.dat")
+LBF_MODEL_PATH = os.environ.get("DROWSINESS_LBF_MODEL_PATH", "lbfmodel.yaml")
+DNN_PROTOTXT_PATH = os.environ.get("DROWSINESS_DNN_PROTOTXT_PATH", "deploy.prototxt")
+DNN_MODEL_PATH = os.environ.get("DROWSINESS_DNN_MODEL_PATH", "res10_300x300_ssd_iter_140000.caffemodel")
+DNN_CONFIDENCE = float(os.environ.get("DROWSINESS_DNN_CONFIDENCE", 0.5))
+
+# Points head pose is estimated from: nose tip, chin, outer eye corners and
+# mouth corners
+HEAD_POSE_POINTS = [33, 8, 36, 45, 48, 54]
+
+# Points the eye/mouth predictor is trained on, in its part order
+EYE_MOUTH_POINTS = list(range(36, 68))
+
+
+class Dlib68Backend:
+    name = "dlib68"
+    points = list(range(68))
+    head_pose = True
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+
+    def preload(self):
+        self.detector()
+        self.predictor()
+
+    # Face detector with the (gray, upsample) -> rects interface
+    def detector(self):
+        return get_detector()
+
+    def predictor(self):
+        return get_predictor(self.model_path)
+
+    # (N, 68, 2) int landmarks for the faces in `rects`
+    def landmarks(self, gray, rects):
+        predictor = self.predictor()
+        return np.stack([face_utils.shape_to_np(predictor(gray, rect)) for rect in rects])
+
+
+class EyeMouthBackend(Dlib68Backend):
+    name = "dlib-eyes-mouth"
+    points = EYE_MOUTH_POINTS
+    head_pose = False
+
+    def predictor(self):
+        return get_predictor(self.model_path or EYE_MOUTH_MODEL_PATH)
+
+    def landmarks(self, gray, rects):
+        predictor = self.predictor()
+        shapes = np.zeros((len(rects), 68, 2), dtype=int)
+        for i, rect in enumerate(rects):
+            shapes[i, EYE_MOUTH_POINTS] = face_utils.shape_to_np(predictor(gray, rect))
+        return shapes
+
+
+# OpenCV's res10 SSD face detector with the (gray, upsample) -> rects
+# interface of dlib's detector. The net is not safe to run from several
+# threads at once, so forward passes are serialized.
+class DnnFaceDetector:
+    def __init__(self, prototxt_path, model_path, confidence=DNN_CONFIDENCE):
+        self.net = cv2.dnn.readNetFromCaffe(resolve_model_path(prototxt_path), resolve_model_path(model_path))
+        self.confidence = confidence
+        self._lock = threading.Lock()
+
+    def __call__(self, gray, upsample=0):
+        (h, w) = gray.shape[:2]
+        image = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR) if gray.ndim == 2 else gray
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        with self._lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()
+
+        rects = []
+        for detection in detections[0, 0]:
+            if detection[2] < self.confidence:
+                continue
+            (left, top, right, bottom) = (detection[3:7] * [w, h, w, h]).astype(int)
+            left, top = max(left, 0), max(top, 0)
+            right, bottom = min(right, w - 1), min(bottom, h - 1)
+            if right > left and bottom > top:
+                rects.append(dlib.rectangle(int(left), int(top), int(right), int(bottom)))
+        return rects
+
+
+# The LBF facemark is shared by every LbfBackend and is not thread safe
+facemark_lock = threading.Lock()
+
+
+class LbfBackend:
+    name = "lbf"
+    points = list(range(68))
+    head_pose = True
+
+    def __init__(self, model_path=None):
+        self.model_path = model_path or LBF_MODEL_PATH
+
+    def preload(self):
+        self.detector()
+        self.facemark()
+
+    def detector(self):
+        return get_model(("dnn_face_detector", DNN_PROTOTXT_PATH, DNN_MODEL_PATH),
+                         lambda: DnnFaceDetector(DNN_PROTOTXT_PATH, DNN_MODEL_PATH))
+
+    def facemark(self):
+        def load():
+            path = resolve_model_path(self.model_path)
+            print("[INFO] loading LBF facemark model from {}...".format(path), file=sys.stderr)
+            facemark = cv2.face.createFacemarkLBF()
+            facemark.loadModel(path)
+            return facemark
+        return get_model(("facemark_lbf", self.model_path), load)
+
+    def landmarks(self, gray, rects):
+        boxes = np.array([[rect.left(), rect.top(), rect.width(), rect.height()] for rect in rects], dtype=np.int32)
+        with facemark_lock:
+            ok, landmarks = self.facemark().fit(gray, boxes)
+        if not ok:
+            raise RuntimeError("LBF facemark found no landmarks")
+        return np.rint(np.concatenate(landmarks)).astype(int)
+
+
+BACKENDS = {backend.name: backend for backend in (Dlib68Backend, EyeMouthBackend, LbfBackend)}
+
+
+# The backend called `name` (default LANDMARK_BACKEND). model_path
+# overrides the backend's landmark model.
+def get_backend(name=None, model_path=None):
+    name = name or LANDMARK_BACKEND
+    if name not in BACKENDS:
+        raise ValueError("unknown landmark backend {!r}, expected one of {}".format(name, ", ".join(BACKENDS)))
+    return BACKENDS[name](model_path)
@@ -1,17 +1,33 @@
-from scipy.spatial import distance as dist
+import numpy as np
 
-def mouth_opening_ratio(mouth):
+# 68-point landmark range passed to mouth_opening_ratio (shape[49:68])
+MOUTH = slice(49, 68)
+
+
+def mouth_opening_ratios(mouths):
+    # mouths is an (..., 19, 2) array of mouth landmarks, e.g. (N, 19, 2)
+    # for N mouths; returns an (...) array of opening ratios
+    mouths = np.asarray(mouths, dtype="double")
     # compute the euclidean distances between the two sets of
     # vertical mouth landmarks (x, y)-coordinates
-    A = dist.euclidean(mouth[2], mouth[10])  # 51, 59
-    B = dist.euclidean(mouth[4], mouth[8])  # 53, 57
+    A = np.linalg.norm(mouths[..., 2, :] - mouths[..., 10, :], axis=-1)  # 51, 59
+    B = np.linalg.norm(mouths[..., 4, :] - mouths[..., 8, :], axis=-1)  # 53, 57
 
     # compute the euclidean distance between the horizontal
     # mouth landmark (x, y)-coordinates
-    C = dist.euclidean(mouth[0], mouth[6])  # 49, 55
+    C = np.linalg.norm(mouths[..., 0, :] - mouths[..., 6, :], axis=-1)  # 49, 55
 
     # compute the mouth aspect ratio
-    mar = (A + B) / (2.0 * C)
+    return (A + B) / (2.0 * C)
+
 
-    # return the mouth aspect ratio
-    return mar
\ No newline at end of file
+def face_mouth_opening_ratios(shapes):
+    # shapes is an (N, 68, 2) stack of landmarks (N faces or N frames);
+    # returns the MOR of each of them
+    shapes = np.asarray(shapes, dtype="double")
+    return mouth_opening_ratios(shapes[..., MOUTH, :])
+
+
+def mouth_opening_ratio(mouth):
+    # return the mouth aspect ratio of a single (19, 2) mouth
+    return float(mouth_opening_ratios(mouth))
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+import dlib
+
+# Landmark model used when no path is given. Relative paths are looked up in
+# the working directory first, then next to this module.
+MODEL_PATH = os.environ.get("DROWSINESS_MODEL_PATH", "shape_predictor_68_face_landmarks.dat")
+
+# Loaded models by key, shared by every caller in the process. Nothing is
+# loaded at import; each model is loaded once, on first use. Loading before
+# the inference workers are forked (preload) lets them share the model's
+# pages copy-on-write instead of each holding its own copy.
+models = {}
+_lock = threading.Lock()
+
+
+# Change the default model path, e.g. from a command line option
+def set_model_path(path):
+    global MODEL_PATH
+    MODEL_PATH = path
+
+
+def resolve_model_path(path=None):
+    path = path or MODEL_PATH
+    if not os.path.isabs(path) and not os.path.exists(path):
+        beside_module = os.path.join(os.path.dirname(os.path.abspath(__file__)), path)
+        if os.path.exists(beside_module):
+            return beside_module
+    return path
+
+
+# The model stored under `key`, calling load() to create it the first time
+def get_model(key, load):
+    model = models.get(key)
+    if model is None:
+        with _lock:
+            model = models.get(key)
+            if model is None:
+                model = models[key] = load()
+    return model
+
+
+# dlib shape_predictor for `path` (default MODEL_PATH, the 68 point model)
+def get_predictor(path=None):
+    path = path or MODEL_PATH
+
+    def load():
+        resolved = resolve_model_path(path)
+        print("[INFO] loading facial landmark predictor from {}...".format(resolved), file=sys.stderr)
+        return dlib.shape_predictor(resolved)
+    return get_model(("shape_predictor", path), load)
+
+
+# dlib's HOG detector holds the GIL while it runs and is not safe to call
+# from several threads at once, so calls through this wrapper are
+# serialized. Threads sharing it gain no detection throughput; only
+# processes detect in parallel.
+class SerializedDetector:
+    def __init__(self, detector):
+        self.detector = detector
+        self._lock = threading.Lock()
+
+    def __call__(self, gray, upsample=0):
+        with self._lock:
+            return self.detector(gray, upsample)
+
+
+# dlib's HOG frontal face detector. Building it takes a few hundred ms, so
+# it is shared the same way.
+def get_detector():
+    return get_model("frontal_face_detector", lambda: SerializedDetector(dlib.get_frontal_face_detector()))
+
+
+# Load the default models now, e.g. in a server's parent process before it
+# forks its workers, or as a pool initializer so the first frame does not
+# pay for it. Does nothing for models that are already loaded.
+def preload(path=None):
+    get_detector()
+    get_predictor(path)
@@ -0,0 +1,93 @@
+import queue
+import sys
+import threading
+import time
+import traceback
+
+
+# Bounded queue that never blocks the producer: when it is full, put()
+# throws away the oldest item so consumers always see the freshest frames
+class DropOldestQueue(queue.Queue):
+    def __init__(self, maxsize=2):
+        super().__init__(maxsize)
+        self.dropped = 0
+
+    def put(self, item, block=True, timeout=None):
+        with self.not_full:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.dropped += 1
+                self.unfinished_tasks -= 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+# Running timing statistics for one pipeline stage
+class StageTimer:
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        avg_ms = 1000.0 * self.total / self.count if self.count else 0.0
+        return "{}: {:.1f} fps, avg {:.1f} ms, max {:.1f} ms".format(
+            self.name, self.count / elapsed if elapsed > 0 else 0.0, avg_ms, 1000.0 * self.max)
+
+
+# Worker thread for one stage. With an inbox it calls fn(item) for every
+# item and forwards non-None results to the outbox; without one it is a
+# source that calls fn() until it returns None, which stops the pipeline.
+# An item fn(item) raises on is logged and dropped; an exception from a
+# source stops the pipeline and is kept in `error` for the caller to raise.
+class Stage(threading.Thread):
+    def __init__(self, name, fn, inbox, outbox, stop_event, timer=None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.stop_event = stop_event
+        self.timer = timer or StageTimer(name)
+        self.failed = 0
+        self.error = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            if self.inbox is None:
+                start = time.perf_counter()
+                try:
+                    result = self.fn()
+                except BaseException as e:
+                    self.error = e
+                    self.stop_event.set()
+                    break
+                if result is None:
+                    self.stop_event.set()
+                    break
+            else:
+                try:
+                    item = self.inbox.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = self.fn(item)
+                except Exception:
+                    self.failed += 1
+                    print("[ERROR] {} stage dropped an item:".format(self.name), file=sys.stderr)
+                    traceback.print_exc()
+                    continue
+            self.timer.record(time.perf_counter() - start)
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
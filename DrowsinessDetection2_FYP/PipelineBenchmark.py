@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# Replays a fixed set of frames through each stage of the detection pipeline
+# (HOG detection, shape_predictor, EAR/MOR, head pose, drawing) and through
+# the full /detect_drowsiness request path on an in-process test client, for
+# several resolutions and face counts. Reports fps, p50/p99 latency and peak
+# traced memory per stage.
+#
+#   python PipelineBenchmark.py --images faces/ --json results.json
+#   python PipelineBenchmark.py --images faces/ --compare results.json
+#
+# Frames for N faces are a grid of N copies of the source frames, so with
+# face images as the source HOG finds N faces. Landmark and later stages
+# always run on the grid cells' boxes, so their cost does not depend on what
+# the detector finds. Synthetic frames (seeded noise) are used when no
+# images or video are given. Runs are comparable across commits as long as
+# the source frames, seed and thread count stay the same; --compare flags
+# stages whose p50 got slower than the baseline by more than --tolerance.
+#
+# Detection and landmarking run once per landmark backend in --backends;
+# backends other than dlib68 show up as e.g. "landmarks@lbf". The other
+# stages use the first backend's landmarks, and the request stage runs the
+# app on the first backend.
+from imutils import face_utils
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import cv2
+import dlib
+import numpy as np
+from EAR import eye_aspect_ratio, face_eye_aspect_ratios
+from MOR import mouth_opening_ratio, face_mouth_opening_ratios
+from HeadPose import getHeadTiltAndCoords
+from FaceDetector import ScaledDetector
+from ModelRegistry import set_model_path, MODEL_PATH
+from LandmarkBackend import get_backend, BACKENDS, HEAD_POSE_POINTS
+
+STAGES = ["detect", "landmarks", "ratios", "ratios_batched", "head_pose", "draw", "request"]
+
+# Memory is traced on a separate, shorter pass so tracing does not skew the
+# timings
+MEMORY_ITERATIONS = 5
+
+
+def load_sources(args):
+    frames = []
+    if args["images"]:
+        for name in sorted(os.listdir(args["images"])):
+            frame = cv2.imread(os.path.join(args["images"], name))
+            if frame is not None:
+                frames.append(frame)
+    elif args["video"]:
+        cap = cv2.VideoCapture(args["video"])
+        while len(frames) < args["source_frames"]:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            frames.append(frame)
+        cap.release()
+    else:
+        rng = np.random.default_rng(args["seed"])
+        for _ in range(args["source_frames"]):
+            noise = rng.integers(0, 256, (360, 640, 3), dtype=np.uint8)
+            frames.append(cv2.GaussianBlur(noise, (9, 9), 0))
+    return frames[:args["source_frames"]]
+
+
+# Grid layout for `faces` cells in a width x height frame
+def grid_cells(width, height, faces):
+    cols = math.ceil(math.sqrt(faces))
+    rows = math.ceil(faces / cols)
+    cell_w, cell_h = width // cols, height // rows
+    return [(c * cell_w, r * cell_h, cell_w, cell_h) for r in range(rows) for c in range(cols)][:faces]
+
+
+# BGR frame made of `faces` copies of the source, and one face box per copy
+def compose_frame(source, width, height, faces):
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    rects = []
+    for (x, y, w, h) in grid_cells(width, height, faces):
+        frame[y:y + h, x:x + w] = cv2.resize(source, (w, h), interpolation=cv2.INTER_AREA)
+        side = min(w, h) // 2
+        left, top = x + (w - side) // 2, y + (h - side) // 2
+        rects.append(dlib.rectangle(left, top, left + side, top + side))
+    return frame, rects
+
+
+# Same drawing as the desktop detector's full overlay
+def draw_overlay(frame, shape, rect, ear, mor, head_tilt):
+    (bX, bY, bW, bH) = face_utils.rect_to_bb(rect)
+    cv2.rectangle(frame, (bX, bY), (bX + bW, bY + bH), (0, 255, 0), 1)
+    for (i, (x, y)) in enumerate(shape):
+        color = (0, 255, 0) if i in [33, 8, 36, 45, 48, 54] else (0, 0, 255)
+        cv2.circle(frame, (int(x), int(y)), 1, color, -1)
+        cv2.putText(frame, str(i + 1), (int(x) - 10, int(y) - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.35, color, 1)
+    cv2.drawContours(frame, [cv2.convexHull(shape[42:48])], -1, (0, 255, 0), 1)
+    cv2.drawContours(frame, [cv2.convexHull(shape[36:42])], -1, (0, 255, 0), 1)
+    cv2.drawContours(frame, [cv2.convexHull(shape[49:68])], -1, (0, 255, 0), 1)
+    cv2.putText(frame, "EAR: {:.2f}".format(ear), (850, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    cv2.putText(frame, "MOR: {:.2f}".format(mor), (650, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+    cv2.putText(frame, 'Head Tilt Degree: ' + str(head_tilt), (170, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                (0, 0, 255), 2)
+
+
+# One callable per stage, each taking a (frame, gray, rects, shapes, jpeg)
+# case and doing that stage's work for every face in it
+def stage_functions(backends, detection_scale, client):
+    functions = {}
+    for backend in backends:
+        suffix = "" if backend.name == "dlib68" else "@" + backend.name
+        detector = ScaledDetector(backend.detector(), detection_scale)
+        functions["detect" + suffix] = lambda case, detector=detector: detector(case["gray"], 0)
+        functions["landmarks" + suffix] = lambda case, backend=backend: backend.landmarks(case["gray"], case["rects"])
+
+    def ratios(case):
+        for shape in case["shapes"]:
+            (eye_aspect_ratio(shape[42:48]) + eye_aspect_ratio(shape[36:42])) / 2.0
+            mouth_opening_ratio(shape[49:68])
+
+    def ratios_batched(case):
+        shapes = np.stack(case["shapes"])
+        face_eye_aspect_ratios(shapes)
+        face_mouth_opening_ratios(shapes)
+
+    def head_pose(case):
+        for shape in case["shapes"]:
+            image_points = shape[HEAD_POSE_POINTS].astype("double")
+            getHeadTiltAndCoords(case["frame"].shape, image_points, case["frame"].shape[0])
+
+    def draw(case):
+        frame = case["frame"].copy()
+        for rect, shape in zip(case["rects"], case["shapes"]):
+            draw_overlay(frame, shape, rect, 0.3, 0.4, 12.5)
+
+    request_count = [0]
+
+    def request(case):
+        request_count[0] += 1
+        response = client.post("/detect_drowsiness", files={"file": ("frame.jpg", case["jpeg"], "image/jpeg")},
+                               data={"session_id": "benchmark", "timestamp": str(request_count[0] / 30.0)})
+        if response.status_code != 200:
+            raise RuntimeError("request failed: {} {}".format(response.status_code, response.text))
+
+    functions.update(ratios=ratios, ratios_batched=ratios_batched)
+    if backends[0].head_pose:
+        functions["head_pose"] = head_pose
+    functions["draw"] = draw
+    if client is not None:
+        functions["request"] = request
+    return functions
+
+
+def run_stage(fn, cases, iterations, warmup):
+    for i in range(warmup):
+        fn(cases[i % len(cases)])
+
+    latencies = []
+    for i in range(iterations):
+        case = cases[i % len(cases)]
+        start = time.perf_counter()
+        fn(case)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    for i in range(MEMORY_ITERATIONS):
+        fn(cases[i % len(cases)])
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        "fps": float(1.0 / latencies.mean()),
+        "p50_ms": float(1000.0 * np.percentile(latencies, 50)),
+        "p99_ms": float(1000.0 * np.percentile(latencies, 99)),
+        "peak_kib": float(max(peak, 0) / 1024.0),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Test client on the app with the inference pool kind chosen here. The
+# app reads its settings from the environment at import. Trip history and
+# calibration are turned off: requests are timed on fixed thresholds and
+# nothing is written to events.db.
+def open_client(args, backend):
+    os.environ["DROWSINESS_POOL"] = args["pool"]
+    os.environ["DROWSINESS_EVENT_DB"] = ""
+    os.environ["DROWSINESS_CALIBRATION_SECONDS"] = "0"
+    os.environ["DROWSINESS_LANDMARK_BACKEND"] = backend.name
+    os.environ["DROWSINESS_MODEL_PATH"] = args["model"]  # For workers that do not fork
+    set_model_path(args["model"])
+    os.environ.setdefault("DROWSINESS_DETECTION_SCALE", str(args["detection_scale"]))
+    try:
+        from fastapi.testclient import TestClient
+        import app
+    except Exception as e:
+        print("[ERROR] Unable to load the app, skipping the request stage: {}".format(e))
+        return None
+    return TestClient(app.app)
+
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print("[INFO] comparing p50 against {} (commit {})".format(baseline_path, baseline["meta"].get("commit")))
+    print("{:<32} {:>10} {:>10} {:>8}".format("case", "base ms", "now ms", "change"))
+    regressions = 0
+    for key, result in results.items():
+        if key not in baseline["results"]:
+            continue
+        before, now = baseline["results"][key]["p50_ms"], result["p50_ms"]
+        change = now / before - 1.0 if before > 0 else 0.0
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{:<32} {:>10.3f} {:>10.3f} {:>+7.1f}%{}".format(key, before, now, 100.0 * change, flag))
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--images", help="directory of source images (ideally one face each)")
+    ap.add_argument("--video", help="video file to take source frames from")
+    ap.add_argument("--source-frames", type=int, default=10, help="number of distinct source frames to cycle")
+    ap.add_argument("--resolutions", default="640x360,1024x576,1280x720", help="comma separated WxH")
+    ap.add_argument("--faces", default="1,2,4", help="comma separated face counts")
+    ap.add_argument("--stages", default=",".join(STAGES), help="comma separated stages to run")
+    ap.add_argument("--iterations", type=int, default=100, help="timed iterations per case")
+    ap.add_argument("--warmup", type=int, default=10, help="untimed iterations per case")
+    ap.add_argument("--seed", type=int, default=0, help="seed for synthetic frames")
+    ap.add_argument("--threads", type=int, default=1, help="OpenCV threads (fixed for comparable runs)")
+    ap.add_argument("--detection-scale", type=float, default=1.0)
+    ap.add_argument("--pool", default="thread", choices=["thread", "process"],
+                    help="inference pool for the request stage (thread keeps it measurable in-process)")
+    ap.add_argument("--backends", default="dlib68",
+                    help="comma separated landmark backends ({})".format(", ".join(BACKENDS)))
+    ap.add_argument("--model", default=MODEL_PATH, help="landmark model of the dlib68 backend")
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="baseline results file to compare against")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed p50 slowdown before flagging")
+    args = vars(ap.parse_args())
+
+    cv2.setNumThreads(args["threads"])
+    sources = load_sources(args)
+    if not sources:
+        print("[ERROR] No frames to benchmark.")
+        return 1
+
+    stages = [s for s in args["stages"].split(",") if s]
+    resolutions = [tuple(int(v) for v in r.split("x")) for r in args["resolutions"].split(",")]
+    face_counts = [int(n) for n in args["faces"].split(",")]
+
+    backends = [get_backend(name, args["model"] if name == "dlib68" else None)
+                for name in args["backends"].split(",") if name]
+    client = open_client(args, backends[0]) if "request" in stages else None
+    if client is not None:
+        client.__enter__()  # Runs the app's startup (pool creation)
+    functions = stage_functions(backends, args["detection_scale"], client)
+
+    results = {}
+    print("[INFO] {} source frame(s), {} iterations, {} OpenCV thread(s), commit {}".format(
+        len(sources), args["iterations"], args["threads"], git_commit()))
+    print("{:<16} {:>10} {:>6} {:>10} {:>10} {:>10} {:>12}".format(
+        "stage", "size", "faces", "fps", "p50 ms", "p99 ms", "peak KiB"))
+    try:
+        for (width, height) in resolutions:
+            for faces in face_counts:
+                cases = []
+                for source in sources:
+                    frame, rects = compose_frame(source, width, height, faces)
+                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    shapes = list(backends[0].landmarks(gray, rects))
+                    jpeg = cv2.imencode(".jpg", frame)[1].tobytes()
+                    cases.append({"frame": frame, "gray": gray, "rects": rects, "shapes": shapes, "jpeg": jpeg})
+
+                for stage in functions:
+                    if stage.split("@")[0] not in stages:
+                        continue
+                    result = run_stage(functions[stage], cases, args["iterations"], args["warmup"])
+                    key = "{}/{}x{}/{}".format(stage, width, height, faces)
+                    results[key] = result
+                    print("{:<16} {:>10} {:>6} {:>10.1f} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+                        stage, "{}x{}".format(width, height), faces,
+                        result["fps"], result["p50_ms"], result["p99_ms"], result["peak_kib"]))
+    finally:
+        if client is not None:
+            client.__exit__(None, None, None)
+
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    max_rss_mib = max_rss / (1024.0 * 1024.0) if sys.platform == "darwin" else max_rss / 1024.0
+    print("[INFO] process peak RSS {:.1f} MiB".format(max_rss_mib))
+
+    if args["json"]:
+        meta = {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "dlib": dlib.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "source": args["images"] or args["video"] or "synthetic",
+            "source_frames": len(sources),
+            "seed": args["seed"],
+            "threads": args["threads"],
+            "iterations": args["iterations"],
+            "detection_scale": args["detection_scale"],
+            "pool": args["pool"],
+            "backends": [backend.name for backend in backends],
+            "peak_rss_mib": max_rss_mib,
+        }
+        with open(args["json"], "w") as f:
+            json.dump({"meta": meta, "results": results}, f, indent=2, sort_keys=True)
+        print("[INFO] wrote {}".format(args["json"]))
+
+    if args["compare"]:
+        return 1 if compare(results, args["compare"], args["tolerance"]) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# Trains shape_predictor_eye_mouth.dat, the model of the dlib-eyes-mouth
+# landmark backend (see LandmarkBackend), on the iBUG 300-W faces dlib's 68
+# point model was trained on, keeping only the eye and mouth points (36-67).
+#
+#   wget http://dlib.net/files/data/ibug_300W_large_face_landmark_dataset.tar.gz
+#   tar xzf ibug_300W_large_face_landmark_dataset.tar.gz
+#   python TrainEyeMouthModel.py ibug_300W_large_face_landmark_dataset
+#
+# Training takes a while and a few GB of memory; the mean error on the test
+# set, in pixels, is printed at the end. Check it against the 68 point model
+# on your own footage before switching a deployment over.
+import argparse
+import os
+import xml.etree.ElementTree as ElementTree
+import dlib
+from LandmarkBackend import EYE_MOUTH_MODEL_PATH, EYE_MOUTH_POINTS
+
+
+# Copy of a dlib imglab dataset file with only the eye and mouth parts. The
+# part names stay "36".."67": dlib orders parts by name, so the model's
+# parts come out in EYE_MOUTH_POINTS order.
+def eye_mouth_dataset(path, out_path):
+    names = {"{:02d}".format(i) for i in EYE_MOUTH_POINTS}
+    tree = ElementTree.parse(path)
+    for box in tree.iter("box"):
+        for part in list(box.findall("part")):
+            if part.get("name") not in names:
+                box.remove(part)
+    # Image paths are relative to the dataset file
+    for image in tree.iter("image"):
+        image.set("file", os.path.join(os.path.dirname(os.path.abspath(path)), image.get("file")))
+    tree.write(out_path)
+    return out_path
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Train the eye and mouth landmark model on iBUG 300-W.")
+    ap.add_argument("dataset", help="directory of dlib's ibug_300W_large_face_landmark_dataset")
+    ap.add_argument("--out", default=EYE_MOUTH_MODEL_PATH, help="model file to write")
+    ap.add_argument("--tree-depth", type=int, default=4)
+    ap.add_argument("--cascade-depth", type=int, default=15)
+    ap.add_argument("--nu", type=float, default=0.1)
+    ap.add_argument("--oversampling", type=int, default=20)
+    ap.add_argument("--threads", type=int, default=os.cpu_count())
+    args = vars(ap.parse_args())
+
+    train = eye_mouth_dataset(os.path.join(args["dataset"], "labels_ibug_300W_train.xml"),
+                              args["out"] + ".train.xml")
+    test = eye_mouth_dataset(os.path.join(args["dataset"], "labels_ibug_300W_test.xml"),
+                             args["out"] + ".test.xml")
+
+    options = dlib.shape_predictor_training_options()
+    options.tree_depth = args["tree_depth"]
+    options.cascade_depth = args["cascade_depth"]
+    options.nu = args["nu"]
+    options.oversampling_amount = args["oversampling"]
+    options.num_threads = args["threads"]
+    options.be_verbose = True
+
+    print("[INFO] training {} on {} points...".format(args["out"], len(EYE_MOUTH_POINTS)))
+    dlib.train_shape_predictor(train, args["out"], options)
+    print("[INFO] mean test error: {:.2f} pixels".format(dlib.test_shape_predictor(test, args["out"])))
+    os.remove(train)
+    os.remove(test)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,34 @@
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, Form, Request, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from PIL import Image
-import io
+import asyncio
+import math
+import sqlite3
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 import cv2
 import numpy as np
-import dlib
-from imutils import face_utils
-from EAR import eye_aspect_ratio
-from MOR import mouth_opening_ratio
+from EAR import face_eye_aspect_ratios
+from MOR import face_mouth_opening_ratios
+from InferencePool import InferencePool, PoolSaturated
+from FaceTracker import detect_faces, REDETECT_INTERVAL
+from FaceDetector import ScaledDetector, DETECTION_SCALE
+from AlertTimer import DrowsinessState
+from LandmarkBackend import get_backend
+from DriverSelector import DriverSelector, select_driver, box_iou, MIN_DRIVER_IOU
+from FaceCrop import parse_box, crop_box_for, face_rect_in_crop, crop_rect_to_frame, plausible_landmarks
+from Calibration import Calibrator, calibrations, CALIBRATION_SECONDS
+from FramePacer import FramePacer, near_thresholds
+from EventStore import EventStore, EVENT_DB_PATH, EVENT_SAMPLE_INTERVAL
+from FrameDiff import is_unchanged, region_reference, CHANGE_THRESHOLD, MAX_REUSED_FRAMES
+from Metrics import REGISTRY, Counter, Gauge, Histogram, COUNT_BUCKETS
 import time
+import os
+import threading
+from collections import OrderedDict
 
 # Initialize the FastAPI app
 app = FastAPI()
@@ -23,105 +42,881 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load dlib's face detector and facial landmark predictor
-detector = dlib.get_frontal_face_detector()
-predictor = dlib.shape_predictor('shape_predictor_68_face_landmarks.dat')
+# The face detector and landmark model come from the landmark backend
+# chosen with DROWSINESS_LANDMARK_BACKEND (dlib68 by default, see
+# LandmarkBackend) and are loaded on first use (or at startup, see
+# start_pool), so importing this module is cheap. The detector runs on a
+# copy downscaled by DROWSINESS_DETECTION_SCALE; landmarks always use the
+# full resolution frame.
+backend = get_backend()
+FACE_DETECTION_SCALE = float(os.environ.get("DROWSINESS_DETECTION_SCALE", DETECTION_SCALE))
 
-# Define global thresholds
-EYE_AR_THRESH = 0.23
-MOUTH_AR_THRESH = 0.65
+# Load the models at import, for servers that import the app once in a
+# parent process and fork workers from it (e.g. gunicorn --preload)
+PRELOAD_MODELS = os.environ.get("DROWSINESS_PRELOAD_MODELS", "0") == "1"
+
+# Limits for the per-driver session store
+MAX_SESSIONS = int(os.environ.get("DROWSINESS_MAX_SESSIONS", 1000))
+SESSION_IDLE_TIMEOUT = float(os.environ.get("DROWSINESS_SESSION_IDLE_TIMEOUT", 300))
+
+# Inference pool settings: "process" or "thread", worker count (defaults to
+# the number of cores) and how many frames may wait before we answer 503.
+# dlib's face detector holds the GIL, so only "process" detects on several
+# frames at once.
+POOL_KIND = os.environ.get("DROWSINESS_POOL", "process")
+POOL_WORKERS = int(os.environ.get("DROWSINESS_WORKERS", 0)) or None
+POOL_MAX_PENDING = int(os.environ.get("DROWSINESS_MAX_PENDING", 0)) or None
+
+# Largest number of frames accepted in one batch request
+MAX_BATCH_FRAMES = int(os.environ.get("DROWSINESS_MAX_BATCH_FRAMES", 64))
+
+# Decode uploads at 1/2, 1/4 or 1/8 resolution (JPEG decodes straight to
+# the smaller size). Face boxes in responses stay in upload coordinates.
+DECODE_REDUCTION = int(os.environ.get("DROWSINESS_DECODE_REDUCTION", 1))
+REDUCED_GRAYSCALE = {1: cv2.IMREAD_GRAYSCALE, 2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+                     4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+if DECODE_REDUCTION not in REDUCED_GRAYSCALE:
+    raise ValueError("DROWSINESS_DECODE_REDUCTION must be 1, 2, 4 or 8, got {}".format(DECODE_REDUCTION))
+
+# Only the driver's face (see DriverSelector; DROWSINESS_DRIVER_REGION sets
+# the seat region) is landmarked and scored. Other faces are dropped after
+# detection unless DROWSINESS_IGNORE_PASSENGERS=0, in which case their
+# boxes are still reported and tracked.
+IGNORE_PASSENGERS = os.environ.get("DROWSINESS_IGNORE_PASSENGERS", "1") == "1"
+
+# Raw batch frame header: capture timestamp (float64 seconds) and JPEG
+# length (uint32), both big-endian, followed by the JPEG bytes
+BATCH_FRAME_HEADER = struct.Struct(">dI")
+
+
+# Timers for one driver's stream. session_id (one per trip) is what the
+# trip history is recorded under, driver_id (the user, across trips) what
+# the driver's calibrated thresholds are saved under. Without a driver_id
+# thresholds are still learned, but only for this session.
+class DriverSession:
+    def __init__(self, now, session_id=None, driver_id=None):
+        self.state = DrowsinessState()  # Eye closed / mouth open timers
+        self.last_seen = now
+        # Face boxes from the last frame, used to narrow the next detection
+        self.face_rects = []
+        self.frames_since_detection = 0
+        self.frame_size = None  # (width, height) of the last full frame
+        self.driver = DriverSelector()  # Which face is the driver
+        self.pacer = FramePacer()  # How soon the client should send the next frame
+        # Trip history sampling: when the last EAR/MOR sample was stored and
+        # how many frames have been scored since
+        self.last_sample_time = None
+        self.unsampled_frames = 0
+        self.session_id = session_id
+        # Last analysis with a driver and the eye and mouth regions frames
+        # are compared against to reuse it (see FrameDiff)
+        self.last_analysis = None
+        self.reference = None
+        self.reused_frames = 0
+
+        # Thresholds saved for this driver (loaded by load_thresholds), or
+        # learned from the first CALIBRATION_SECONDS of their frames while
+        # the defaults apply
+        self.driver_id = driver_id
+        self.thresholds_loaded = None  # Future of the load, once started
+        self.calibrator = None
+        self.save_calibration = False
+        self.start_calibration()
+
+    # Learn the thresholds afresh; they are saved under driver_id when they
+    # are for the signed in driver (`save`)
+    def start_calibration(self, save=True):
+        self.calibrator = Calibrator() if CALIBRATION_SECONDS > 0 else None
+        self.save_calibration = save and self.driver_id is not None
+
+    # Switch to thresholds saved for the driver, if there are any
+    def apply_thresholds(self, thresholds):
+        if thresholds is None:
+            return
+        self.state.eye_thresh = thresholds["eye_thresh"]
+        self.state.mouth_thresh = thresholds["mouth_thresh"]
+        self.calibrator = None
+
+    # Feed one driver frame to the calibration, if it is running. Once it
+    # completes the new thresholds apply and are saved; returns True then.
+    def calibrate(self, timestamp, ear, mor):
+        if self.calibrator is None:
+            return False
+        thresholds = self.calibrator.add(timestamp, ear, mor)
+        if thresholds is None:
+            return False
+        self.state.eye_thresh = thresholds["eye_thresh"]
+        self.state.mouth_thresh = thresholds["mouth_thresh"]
+        self.calibrator = None
+        if self.save_calibration:
+            calibration_writer.submit(save_thresholds, self.driver_id, thresholds)
+        return True
+
+
+# Calibrations are read and written on their own threads, never on the
+# event loop or under the session store's lock
+calibration_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="calibrations")
+
+
+def save_thresholds(driver_id, thresholds):
+    try:
+        calibrations.put(driver_id, thresholds)
+    except sqlite3.Error as e:
+        print("[ERROR] Unable to save thresholds for {}: {}".format(driver_id, e), file=sys.stderr)
+
+
+# Load the session's saved thresholds, once per session; every request
+# waits for the same load before its frames are scored
+async def load_thresholds(session: DriverSession):
+    if session.driver_id is None:
+        return
+    if session.thresholds_loaded is None:
+        async def load():
+            try:
+                session.apply_thresholds(await asyncio.to_thread(calibrations.get, session.driver_id))
+            except sqlite3.Error as e:
+                print("[ERROR] Unable to load thresholds for {}: {}".format(session.driver_id, e), file=sys.stderr)
+        session.thresholds_loaded = asyncio.ensure_future(load())
+    await session.thresholds_loaded
+
+
+# Bounded map of session id -> DriverSession, least recently seen first.
+# Sessions idle for longer than idle_timeout are dropped, and the oldest
+# session is evicted once max_sessions is reached.
+class SessionStore:
+    def __init__(self, max_sessions=MAX_SESSIONS, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, now=None, driver_id=None):
+        if now is None:
+            now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                session = DriverSession(now, session_id, driver_id)
+            session.last_seen = now
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def _evict_idle(self, now):
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.last_seen < self.idle_timeout:
+                break
+            self._sessions.popitem(last=False)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+sessions = SessionStore()
+
+detector = None
+
+
+def face_detector():
+    global detector
+    if detector is None:
+        detector = ScaledDetector(backend.detector(), FACE_DETECTION_SCALE)
+    return detector
+
+
+# Pool initializer: load the backend's models as the worker starts
+def preload():
+    backend.preload()
+    face_detector()
+
+
+# Prometheus metrics, served on /metrics. Stage timings are measured inside
+# the pool job and recorded here when its result comes back, since process
+# workers do not share this registry.
+stage_seconds = Histogram("drowsiness_stage_seconds", "Time spent in each inference stage per frame",
+                          ["stage"])
+request_seconds = Histogram("drowsiness_request_seconds", "HTTP request latency", ["route"])
+frames_total = Counter("drowsiness_frames_total", "Frames analyzed")
+events_dropped_total = Counter("drowsiness_events_dropped_total",
+                               "Trip history events dropped: write buffer full, or not storable (non-finite values)")
+events_pending = Gauge("drowsiness_events_pending", "Trip history events waiting to be written")
+events_pending.set_function(lambda: event_store.pending if event_store is not None else 0)
+crop_fallbacks_total = Counter("drowsiness_crop_fallbacks_total",
+                               "Face crops whose landmarks looked wrong, so the crop was searched for the face")
+frames_reused_total = Counter("drowsiness_frames_reused_total",
+                              "Frames that reused the previous analysis because the eye and mouth regions barely "
+                              "changed")
+frames_skipped_total = Counter("drowsiness_frames_skipped_total", "Frames dropped because the pool was saturated")
+faces_per_frame = Histogram("drowsiness_faces_per_frame", "Faces found per frame", buckets=COUNT_BUCKETS)
+alerts_total = Counter("drowsiness_alerts_total", "Alerts fired", ["type"])
+frame_interval = Histogram("drowsiness_next_frame_interval_seconds", "Next-frame interval recommended to clients",
+                           buckets=(0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0))
+calibrations_total = Counter("drowsiness_calibrations_total", "Driver threshold calibrations completed")
+pending_frames = Gauge("drowsiness_pending_frames", "Frames queued or running on the inference pool")
+active_sessions = Gauge("drowsiness_sessions", "Driver sessions held in memory")
+active_sessions.set_function(lambda: len(sessions))
+pending_frames.set_function(lambda: pool.pending if pool is not None else 0)
+
+# Convert a PIL image to a grayscale OpenCV frame. Works for RGB, RGBA,
+# palette and grayscale images alike.
+def image_to_gray(image: Image):
+    return np.asarray(image.convert("L"))
+
+
+# Decode an encoded image (JPEG, PNG, ...) straight to grayscale, at
+# 1/reduction of its size
+def decode_gray(image_data, reduction=DECODE_REDUCTION):
+    gray = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), REDUCED_GRAYSCALE[reduction])
+    if gray is None:
+        raise ValueError("unable to decode image")
+    return gray
+
+
+# View a raw 8-bit grayscale buffer as a frame, without copying it
+def raw_gray(buffer, width, height):
+    if width <= 0 or height <= 0 or len(buffer) != width * height:
+        raise ValueError("raw frame is {} bytes, expected {}x{}".format(len(buffer), width, height))
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(height, width)
+
+
+def scale_box(box, factor):
+    return [int(round(v * factor)) for v in box]
+
+
+# Previous face boxes to search around, or None when it is time for a full
+# frame detection
+def tracking_hint(face_rects, frames_since_detection):
+    if face_rects and frames_since_detection < REDETECT_INTERVAL:
+        return face_rects
+    return None
+
+
+# Tracking state after a frame analysis
+def advance_tracking(frames_since_detection, analysis):
+    face_rects = [face["rect"] for face in analysis["faces"]]
+    if analysis["full_detection"]:
+        return face_rects, 0
+    return face_rects, frames_since_detection + 1
+
+
+# Run face detection on a grayscale frame, pick the driver among the faces
+# and return the driver's EAR/MOR along with the face boxes. "driver" is the
+# driver's index in "faces" (None when there is no driver in view) and
+# "same_driver" whether it is the face previous_driver was. Holds no
+# session state, so it is safe to run on any inference worker. The time
+# spent in each stage, in seconds, is returned under "timings".
+#
+# With a reference from the last analysis, a frame whose eye and mouth
+# regions have barely changed is not analyzed: the result is just
+# {"unchanged": True} and the caller reuses the last analysis. Analyses
+# with a driver carry the reference for the next frame, the driver's eye
+# and mouth regions around their landmarks, under "reference".
+def analyze_frame(gray, previous_rects=None, timings=None, previous_driver=None, reference=None):
+    timings = {} if timings is None else timings
+
+    if reference is not None:
+        start = time.perf_counter()
+        unchanged, change = is_unchanged(gray, reference)
+        timings["change"] = time.perf_counter() - start
+        if unchanged:
+            return {"unchanged": True, "change": change, "timings": timings}
+
+    # Detect faces, only around last frame's faces when we have them
+    start = time.perf_counter()
+    rects, full_detection = detect_faces(face_detector(), gray, previous_rects)
+    timings["detect"] = time.perf_counter() - start
+
+    analysis = {"faces": [], "face_count": len(rects), "driver": None, "same_driver": False,
+                "full_detection": full_detection, "frame_size": [gray.shape[1], gray.shape[0]],
+                "timings": timings}
+    driver, same_driver = select_driver(rects, gray.shape, previous_driver)
+    if not IGNORE_PASSENGERS:
+        analysis["faces"] = [{"ear": None, "mor": None, "rect": [rect.left(), rect.top(), rect.right(), rect.bottom()]}
+                             for rect in rects]
+    if driver is None:
+        return analysis
+
+    # Landmarks of the driver's face only, as a (1, 68, 2) array
+    start = time.perf_counter()
+    shapes = backend.landmarks(gray, [rects[driver]])
+    timings["landmarks"] = time.perf_counter() - start
+
+    # Eye Aspect Ratio (EAR) for closed eyes detection and Mouth Opening
+    # Ratio (MOR) for yawning detection
+    start = time.perf_counter()
+    ear = float(face_eye_aspect_ratios(shapes)[0])
+    mor = float(face_mouth_opening_ratios(shapes)[0])
+    timings["ratios"] = time.perf_counter() - start
+
+    rect = rects[driver]
+    face = {"ear": ear, "mor": mor, "rect": [rect.left(), rect.top(), rect.right(), rect.bottom()]}
+    if CHANGE_THRESHOLD > 0:
+        analysis["reference"] = region_reference(gray, shapes[0])
+    if IGNORE_PASSENGERS:
+        analysis["faces"] = [face]
+        driver = 0
+    else:
+        analysis["faces"][driver] = face
+    analysis.update(driver=driver, same_driver=same_driver)
+    return analysis
+
+
+# Pool job for one uploaded image: decode and analyze it. With a reduced
+# decode the frame is analyzed at the smaller size and the face boxes are
+# mapped back to upload coordinates.
+def analyze_upload(image_data, previous_rects=None, previous_driver=None, reduction=DECODE_REDUCTION,
+                   reference=None):
+    start = time.perf_counter()
+    gray = decode_gray(image_data, reduction)
+    timings = {"decode": time.perf_counter() - start}
+    if reduction == 1:
+        return analyze_frame(gray, previous_rects, timings, previous_driver, reference)
+
+    if previous_rects:
+        previous_rects = [scale_box(rect, 1.0 / reduction) for rect in previous_rects]
+    if previous_driver is not None:
+        previous_driver = scale_box(previous_driver, 1.0 / reduction)
+    if reference is not None:
+        reference = [(scale_box(box, 1.0 / reduction), thumbnail) for (box, thumbnail) in reference]
+    analysis = analyze_frame(gray, previous_rects, timings, previous_driver, reference)
+    if analysis.get("unchanged"):
+        return analysis
+    for face in analysis["faces"]:
+        face["rect"] = scale_box(face["rect"], reduction)
+    if analysis.get("reference") is not None:
+        analysis["reference"] = [(scale_box(box, reduction), thumbnail)
+                                 for (box, thumbnail) in analysis["reference"]]
+    analysis["frame_size"] = scale_box(analysis["frame_size"], reduction)
+    return analysis
+
+
+# Pool job for a raw grayscale frame sent by the client
+def analyze_raw(buffer, width, height, previous_rects=None, previous_driver=None, reference=None):
+    start = time.perf_counter()
+    gray = raw_gray(buffer, width, height)
+    return analyze_frame(gray, previous_rects, {"decode": time.perf_counter() - start}, previous_driver, reference)
+
+
+# Pool job for a face crop the client cut from `crop_box` of its frame
+# (encoded, or raw grayscale when width and height are given). Landmarks
+# run on the crop with the face rectangle taken from the crop box and the
+# previous driver box, skipping detection. When the landmarks do not look
+# like a face there the crop is searched for one, and when there is none
+# the result has no faces, so the client is sent back to full frames.
+def analyze_crop(image_data, crop_box, previous_driver=None, width=None, height=None):
+    start = time.perf_counter()
+    gray = raw_gray(image_data, width, height) if width is not None else decode_gray(image_data, 1)
+    timings = {"decode": time.perf_counter() - start}
+    analysis = {"faces": [], "face_count": 0, "driver": None, "same_driver": False,
+                "full_detection": False, "crop_fallback": False, "timings": timings}
+
+    rect = face_rect_in_crop(gray.shape, crop_box, previous_driver)
+    start = time.perf_counter()
+    shape = backend.landmarks(gray, [rect])[0]
+    timings["landmarks"] = time.perf_counter() - start
+
+    lone_face = True
+    if not plausible_landmarks(shape, rect):
+        analysis["crop_fallback"] = True
+        start = time.perf_counter()
+        rects = face_detector()(gray, 0)
+        timings["detect"] = time.perf_counter() - start
+        driver, _ = select_driver(rects, gray.shape, region=None)
+        if driver is None:
+            return analysis
+        lone_face = len(rects) == 1
+        rect = rects[driver]
+        start = time.perf_counter()
+        shape = backend.landmarks(gray, [rect])[0]
+        timings["landmarks"] += time.perf_counter() - start
+
+    start = time.perf_counter()
+    ear = float(face_eye_aspect_ratios(shape[np.newaxis])[0])
+    mor = float(face_mouth_opening_ratios(shape[np.newaxis])[0])
+    timings["ratios"] = time.perf_counter() - start
+
+    box = crop_rect_to_frame(rect, gray.shape, crop_box)
+    # A lone face in the crop is the driver, as in select_driver
+    same_driver = previous_driver is not None and (lone_face or box_iou(box, previous_driver) >= MIN_DRIVER_IOU)
+    analysis.update(faces=[{"ear": ear, "mor": mor, "rect": box}], face_count=1, driver=0, same_driver=same_driver)
+    return analysis
+
+
+# Pool job for a batch: decode and analyze every frame in one pass, tracking
+# faces and the driver from frame to frame and skipping unchanged frames
+# the way update_session will replay them. The timers only run after the
+# job, so an analyzed frame only becomes the reference for the next ones
+# while its EAR/MOR are clear of the session's `thresholds` (eye, mouth).
+def analyze_uploads(images_data, face_rects, frames_since_detection, previous_driver=None, reference=None,
+                    reused_frames=0, thresholds=None):
+    analyses = []
+    for image_data in images_data:
+        analysis = analyze_upload(image_data, tracking_hint(face_rects, frames_since_detection), previous_driver,
+                                  DECODE_REDUCTION, reference if reused_frames < MAX_REUSED_FRAMES else None)
+        analyses.append(analysis)
+        if analysis.get("unchanged"):
+            reused_frames += 1
+            frames_since_detection += 1
+            continue
+
+        reused_frames = 0
+        reference = None
+        face_rects, frames_since_detection = advance_tracking(frames_since_detection, analysis)
+        if analysis["driver"] is not None:
+            face = analysis["faces"][analysis["driver"]]
+            previous_driver = face["rect"]
+            if thresholds is not None and not near_thresholds(face["ear"], face["mor"], *thresholds):
+                reference = analysis.get("reference")
+    return analyses
+
+
+# A capture timestamp the timers can run on; an infinite one would make
+# every later frame look older and be ignored
+def check_timestamp(timestamp):
+    if not math.isfinite(timestamp):
+        raise ValueError("timestamp {!r} is not finite".format(timestamp))
+    return timestamp
+
+
+# Split a raw batch body into (timestamp, image bytes) pairs; raises
+# ValueError for a truncated body or a non-finite timestamp
+def parse_batch_buffer(buffer):
+    frames = []
+    offset = 0
+    while offset < len(buffer):
+        if offset + BATCH_FRAME_HEADER.size > len(buffer):
+            raise ValueError("truncated frame header at byte {}".format(offset))
+        timestamp, length = BATCH_FRAME_HEADER.unpack_from(buffer, offset)
+        offset += BATCH_FRAME_HEADER.size
+        if offset + length > len(buffer):
+            raise ValueError("truncated frame data at byte {}".format(offset))
+        frames.append((check_timestamp(timestamp), buffer[offset:offset + length]))
+        offset += length
+    return frames
+
+
+# Parse a comma separated list of capture timestamps (seconds)
+def parse_timestamps(text):
+    times = []
+    for value in text.split(","):
+        if not value.strip():
+            continue
+        try:
+            timestamp = float(value)
+        except ValueError:
+            raise ValueError("timestamp {!r} is not a number".format(value.strip()))
+        times.append(check_timestamp(timestamp))
+    return times
+
+
+# Reference the next frame of the session is compared against, or None when
+# it has to be analyzed anyway: after MAX_REUSED_FRAMES reused frames, and
+# whenever a timer is running or the driver's EAR/MOR are near or heading
+# for their thresholds, so the timers only ever see fresh ratios then
+def change_reference(session: DriverSession):
+    if session.reused_frames >= MAX_REUSED_FRAMES or session.pacer.at_risk:
+        return None
+    if session.state.eyes.start_time is not None or session.state.mouth.start_time is not None:
+        return None
+    return session.reference
+
+
+# Advance the session's eye/mouth timers with the frame analysis of a frame
+# captured at `timestamp`
+def update_session(session: DriverSession, analysis, timestamp):
+    # An unchanged frame stands for the last analysis again; the timers
+    # still advance on it
+    reused = bool(analysis.get("unchanged"))
+    if reused:
+        analysis = dict(session.last_analysis, timings=analysis["timings"], full_detection=False,
+                        same_driver=True)
+        session.reused_frames += 1
+        frames_reused_total.inc()
+    else:
+        reference = analysis.pop("reference", None)
+        session.reused_frames = 0
+        session.reference = None
+        if analysis["driver"] is not None and reference is not None:
+            session.last_analysis = analysis
+            session.reference = reference
+
+    session.face_rects, session.frames_since_detection = advance_tracking(
+        session.frames_since_detection, analysis)
+
+    # Eye closed for 2 seconds / mouth open for 5 seconds, in capture time,
+    # on the driver's face only. Frames without a driver leave the timers
+    # as they are.
+    ear = mor = None
+    if analysis["driver"] is None:
+        result = session.state.update(timestamp, None, None)
+    else:
+        face = analysis["faces"][analysis["driver"]]
+        ear, mor = face["ear"], face["mor"]
+        if session.driver.update(face["rect"], analysis["same_driver"]):
+            # Someone else took the seat; their thresholds are learned
+            # afresh for this session only, as they may be a passenger
+            session.state.reset()
+            session.pacer.reset()
+            session.start_calibration(save=False)
+        if not reused and session.calibrate(timestamp, ear, mor):
+            calibrations_total.inc()
+        result = session.state.update(timestamp, ear, mor)
+    result["calibrating"] = session.calibrator is not None
+    result["reused"] = reused
+
+    # Seconds the client should wait before sending the next frame: short
+    # while a timer runs or the driver's EAR/MOR are heading for one, longer
+    # while they are clearly alert
+    result["next_frame_interval"] = session.pacer.update(timestamp, session.state, ear, mor,
+                                                         result["calibrating"])
+    record_trip_events(session, timestamp, ear, mor, result["fired"])
+
+    # The driver's last face box, and the region to send as a face crop
+    # next (see FaceCrop). crop_box is None when a full frame is due: no
+    # driver in view, or REDETECT_INTERVAL frames since the last full
+    # detection.
+    if analysis.get("frame_size") is not None:
+        session.frame_size = analysis["frame_size"]
+    result["face_box"] = list(session.driver.box) if session.driver.box is not None else None
+    result["crop_box"] = None
+    if analysis["driver"] is not None and tracking_hint(session.face_rects, session.frames_since_detection):
+        result["crop_box"] = crop_box_for(result["face_box"], session.frame_size)
+    record_frame_metrics(analysis, result)
+    return result
+
+
+# Buffer the frame for the session's trip history: every alert, and the
+# EAR/MOR at most every EVENT_SAMPLE_INTERVAL seconds. Only appends to the
+# event store's buffer; the writes happen on its own thread.
+def record_trip_events(session: DriverSession, timestamp, ear, mor, fired):
+    if event_store is None or session.session_id is None:
+        return
+    session.unsampled_frames += 1
+    for event_type in fired:
+        if not event_store.alert(session.session_id, timestamp, event_type):
+            events_dropped_total.inc()
+    if session.last_sample_time is None or timestamp - session.last_sample_time >= EVENT_SAMPLE_INTERVAL:
+        if not event_store.sample(session.session_id, timestamp, ear, mor, session.unsampled_frames):
+            events_dropped_total.inc()
+        session.last_sample_time = timestamp
+        session.unsampled_frames = 0
+
+
+def record_frame_metrics(analysis, result):
+    frames_total.inc()
+    faces_per_frame.observe(analysis["face_count"])
+    frame_interval.observe(result["next_frame_interval"])
+    for stage, seconds in analysis.get("timings", {}).items():
+        stage_seconds.labels(stage).observe(seconds)
+    for event_type in result["fired"]:
+        alerts_total.labels(event_type).inc()
+    if analysis.get("crop_fallback"):
+        crop_fallbacks_total.inc()
 
-# Define timers for eye and mouth detection
-eye_start_time = None  # Timer for eyes closed detection
-mouth_start_time = None  # Timer for mouth open detection
 
 # Helper function for detecting drowsiness in the frame
-def detect_drowsiness_in_image(image: Image):
-    global eye_start_time, mouth_start_time
-
-    # Convert PIL Image to OpenCV format (numpy array)
-    frame = np.array(image)
-    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)  # Convert from RGB to BGR
-
-    # Convert frame to grayscale
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-
-    # Detect faces
-    rects = detector(gray, 0)
-
-    # Initialize flags for detecting drowsiness causes
-    eyes_closed_detected = False
-    mouth_open_detected = False
-
-    for rect in rects:
-        shape = predictor(gray, rect)
-        shape = face_utils.shape_to_np(shape)
-
-        # Eye Aspect Ratio (EAR) for closed eyes detection
-        (lStart, lEnd) = face_utils.FACIAL_LANDMARKS_IDXS["left_eye"]
-        (rStart, rEnd) = face_utils.FACIAL_LANDMARKS_IDXS["right_eye"]
-        leftEye = shape[lStart:lEnd]
-        rightEye = shape[rStart:rEnd]
-        leftEAR = eye_aspect_ratio(leftEye)
-        rightEAR = eye_aspect_ratio(rightEye)
-        ear = (leftEAR + rightEAR) / 2.0
-
-        # Detect if eyes are closed for a certain duration
-        if ear <= EYE_AR_THRESH:
-            if eye_start_time is None:
-                eye_start_time = time.time()
-            else:
-                duration = time.time() - eye_start_time
-                if duration >= 2:  # Eyes closed for 2 seconds
-                    eyes_closed_detected = True
-        else:
-            eye_start_time = None  # Reset timer if eyes are open
-
-        # Mouth Opening Ratio (MOR) for yawning detection
-        (mStart, mEnd) = (49, 68)  # Indices for mouth landmarks
-        mouth = shape[mStart:mEnd]
-        mor = mouth_opening_ratio(mouth)
-
-        # Detect if mouth is open for a certain duration
-        if mor > MOUTH_AR_THRESH:
-            if mouth_start_time is None:
-                mouth_start_time = time.time()
-            else:
-                duration = time.time() - mouth_start_time
-                if duration >= 5:  # Mouth open for 2 seconds
-                    mouth_open_detected = True
-        else:
-            mouth_start_time = None  # Reset timer if mouth is closed
+def detect_drowsiness_in_image(image: Image, session: DriverSession):
+    hint = tracking_hint(session.face_rects, session.frames_since_detection)
+    analysis = analyze_frame(image_to_gray(image), hint, previous_driver=session.driver.box,
+                             reference=change_reference(session))
+    return update_session(session, analysis, time.time())
 
-    # Determine if alert is triggered by either or both conditions
-    alert_triggered = eyes_closed_detected or mouth_open_detected
 
-    return {
-        "alert_triggered": alert_triggered,
-        "eyes_closed": eyes_closed_detected,
-        "mouth_open": mouth_open_detected,
-    }
+# Created on startup so that worker processes importing this module do not
+# start pools of their own
+pool = None
+event_store = None  # Trip history, unless DROWSINESS_EVENT_DB is empty
+
+if PRELOAD_MODELS:
+    preload()
+
+
+# Request latency per route template, so arbitrary paths cannot create new
+# series
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    if route is not None:
+        request_seconds.labels(route.path).observe(time.perf_counter() - start)
+    return response
+
+
+@app.on_event("startup")
+def start_pool():
+    global pool, event_store
+    # Load the models before the pool forks its workers so they share them
+    # copy-on-write; workers started without fork load them as they start
+    preload()
+    pool = InferencePool(POOL_KIND, POOL_WORKERS, POOL_MAX_PENDING, initializer=preload)
+    if EVENT_DB_PATH:
+        event_store = EventStore(EVENT_DB_PATH, on_drop=events_dropped_total.inc)
+        event_store.start()
+
+
+@app.on_event("shutdown")
+def stop_pool():
+    if pool is not None:
+        pool.shutdown()
+    if event_store is not None:
+        event_store.stop()  # Writes whatever is still buffered
+    calibration_writer.submit(lambda: None).result()  # Waits for the saves queued before it
 
 
 # Endpoint to handle drowsiness detection
 @app.post("/detect_drowsiness")
 @app.post("/detect_drowsiness/")
-async def detect_drowsiness(file: UploadFile = File(...)):
+# Clients that can scale and convert frames themselves may send the file as
+# raw 8-bit grayscale pixels, giving its width and height. Clients may also
+# send only the face, cut from the crop_box of the previous response, with
+# that box as "left,top,right,bottom"; face detection is skipped for it.
+# driver_id (e.g. the signed in user) keeps the driver's calibrated
+# thresholds across sessions.
+async def detect_drowsiness(file: UploadFile = File(...), session_id: str = Form("default"),
+                            timestamp: float = Form(None), width: int = Form(None), height: int = Form(None),
+                            crop_box: str = Form(None), driver_id: str = Form(None)):
     try:
+        # Timers run on the client's capture timestamp when it sends one,
+        # otherwise on arrival time, so queueing does not stretch them
+        received_at = check_timestamp(timestamp) if timestamp is not None else time.time()
+
         # Read image data from incoming request
         image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
 
-        # Detect drowsiness
-        result = detect_drowsiness_in_image(image)
+        # Decode and detect on the inference pool, off the event loop. The
+        # session store runs on server time; the client's timestamp only
+        # drives the timers.
+        session = sessions.get(session_id, driver_id=driver_id)
+        await load_thresholds(session)
+        hint = tracking_hint(session.face_rects, session.frames_since_detection)
+        if width is not None or height is not None:
+            if width is None or height is None or len(image_data) != width * height:
+                return JSONResponse(content={"error": "raw frame needs width and height matching its size"},
+                                    status_code=400)
+        if crop_box is not None:
+            analysis = await pool.run(analyze_crop, image_data, parse_box(crop_box), session.driver.box,
+                                      width, height)
+        elif width is not None:
+            analysis = await pool.run(analyze_raw, image_data, width, height, hint, session.driver.box,
+                                      change_reference(session))
+        else:
+            analysis = await pool.run(analyze_upload, image_data, hint, session.driver.box, DECODE_REDUCTION,
+                                      change_reference(session))
+
+        # Detect drowsiness against this driver's own timers
+        result = update_session(session, analysis, received_at)
 
         # Return detailed response
         return JSONResponse(content=result)
 
+    except PoolSaturated as e:
+        # Tell the client to drop this frame and send a fresh one
+        frames_skipped_total.inc()
+        return JSONResponse(content={"error": str(e), "skipped": True}, status_code=503)
+
+    except ValueError as e:
+        # Non-finite timestamp, undecodable image, mismatched raw frame size
+        # or bad crop box
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+# Score timestamped frames for one session in one pool job and replay them
+# through the session timers in capture order. The job counts as one
+# pending job per frame against the pool's limit.
+async def score_batch(session_id, frames, driver_id=None):
+    if not frames:
+        return JSONResponse(content={"error": "no frames in batch"}, status_code=400)
+    if len(frames) > MAX_BATCH_FRAMES:
+        return JSONResponse(content={"error": "batch exceeds {} frames".format(MAX_BATCH_FRAMES)},
+                            status_code=413)
+
+    frames = sorted(frames, key=lambda frame: frame[0])
+    session = sessions.get(session_id, driver_id=driver_id)
+    await load_thresholds(session)
+    try:
+        analyses = await pool.run(analyze_uploads, [image_data for _, image_data in frames],
+                                  session.face_rects, session.frames_since_detection, session.driver.box,
+                                  change_reference(session), session.reused_frames,
+                                  (session.state.eye_thresh, session.state.mouth_thresh), weight=len(frames))
+    except PoolSaturated as e:
+        frames_skipped_total.inc(len(frames))
+        return JSONResponse(content={"error": str(e), "skipped": True}, status_code=503)
+    except ValueError as e:
+        # An undecodable frame; nothing of the batch was applied
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+    results = []
+    for (timestamp, _), analysis in zip(frames, analyses):
+        result = update_session(session, analysis, timestamp)
+        result["timestamp"] = timestamp
+        result["faces"] = analysis["faces"] if not analysis.get("unchanged") else session.last_analysis["faces"]
+        results.append(result)
+
+    last_timestamp = frames[-1][0]
+    return JSONResponse(content={
+        "frames": results,
+        "alert_triggered": results[-1]["alert_triggered"],
+        "eyes_closed": results[-1]["eyes_closed"],
+        "mouth_open": results[-1]["mouth_open"],
+        "next_frame_interval": results[-1]["next_frame_interval"],
+        # How long each timer has been running at the last frame, if at all
+        "eyes_closed_for": session.state.eyes.elapsed(last_timestamp),
+        "mouth_open_for": session.state.mouth.elapsed(last_timestamp),
+    })
+
+
+# Batch endpoint: multipart frames plus a comma separated list of their
+# capture timestamps (seconds), one per file
+@app.post("/detect_drowsiness_batch")
+async def detect_drowsiness_batch(files: List[UploadFile] = File(...), timestamps: str = Form(...),
+                                  session_id: str = Form("default"), driver_id: str = Form(None)):
+    try:
+        try:
+            times = parse_timestamps(timestamps)
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        if len(times) != len(files):
+            return JSONResponse(content={"error": "got {} timestamps for {} files".format(len(times), len(files))},
+                                status_code=400)
+        frames = [(timestamp, await file.read()) for timestamp, file in zip(times, files)]
+        return await score_batch(session_id, frames, driver_id)
+
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+# Batch endpoint for a single concatenated buffer of BATCH_FRAME_HEADER
+# framed JPEGs
+@app.post("/detect_drowsiness_batch/raw")
+async def detect_drowsiness_batch_raw(request: Request, session_id: str = "default", driver_id: str = None):
+    try:
+        try:
+            frames = parse_batch_buffer(await request.body())
+        except ValueError as e:
+            return JSONResponse(content={"error": str(e)}, status_code=400)
+        return await score_batch(session_id, frames, driver_id)
+
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+# Streaming endpoint: the client sends binary JPEG frames over one
+# connection and gets a "result" message back for every frame scored, plus
+# an "alert" message the moment a timer fires. The timers live on the
+# connection; a session_id query parameter records the trip history under
+# it, and with a driver_id the driver's calibrated thresholds are loaded
+# and saved under that. Only the newest frame is kept while a frame is being scored,
+# so a slow server skips frames instead of falling behind.
+@app.websocket("/ws/detect_drowsiness")
+async def detect_drowsiness_stream(websocket: WebSocket, session_id: str = None, driver_id: str = None):
+    await websocket.accept()
+    session = DriverSession(time.time(), session_id, driver_id)
+    await load_thresholds(session)
+    latest = {"frame": None}
+    frame_ready = asyncio.Event()
+    closed = asyncio.Event()
+
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                image_data = message.get("bytes")
+                if image_data is None:
+                    # Text frames are answered, not scored, and the stream goes on
+                    await websocket.send_json({"type": "error", "error": "frames must be sent as binary messages"})
+                    continue
+                latest["frame"] = (time.time(), image_data)
+                frame_ready.set()
+        except WebSocketDisconnect:
+            pass
+        except Exception as e:
+            print("[ERROR] websocket receiver failed: {!r}".format(e), file=sys.stderr)
+            try:
+                await websocket.close(code=1011)
+            except Exception:
+                pass
+        finally:
+            closed.set()
+            frame_ready.set()
+
+    receiver = asyncio.create_task(receive_frames())
+    try:
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            if closed.is_set():
+                break
+            received_at, image_data = latest["frame"]
+            latest["frame"] = None
+
+            try:
+                hint = tracking_hint(session.face_rects, session.frames_since_detection)
+                analysis = await pool.run(analyze_upload, image_data, hint, session.driver.box, DECODE_REDUCTION,
+                                          change_reference(session))
+            except PoolSaturated:
+                frames_skipped_total.inc()
+                await websocket.send_json({"type": "skipped", "timestamp": received_at})
+                continue
+            except Exception as e:
+                await websocket.send_json({"type": "error", "error": str(e)})
+                continue
+
+            result = update_session(session, analysis, received_at)
+            if result["fired"]:
+                await websocket.send_json({"type": "alert", "timestamp": received_at,
+                                           "eyes_closed": result["eyes_closed"],
+                                           "mouth_open": result["mouth_open"]})
+            await websocket.send_json(dict(result, type="result", timestamp=received_at))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "sessions": len(sessions),
+        "pending_frames": pool.pending if pool is not None else 0,
+    }
+
+
+# Trip history: summaries of the trips whose session id starts with
+# `prefix` (the app's session ids start with the user id), newest first.
+# Events reach the database within DROWSINESS_EVENT_FLUSH_INTERVAL seconds.
+@app.get("/trips")
+def list_trips(prefix: str = "", limit: int = 50):
+    if event_store is None:
+        return JSONResponse(content={"error": "trip history is disabled"}, status_code=404)
+    return {"trips": event_store.trips(prefix, max(1, min(limit, 500)))}
+
+
+@app.get("/trips/{session_id}")
+def get_trip(session_id: str):
+    if event_store is None:
+        return JSONResponse(content={"error": "trip history is disabled"}, status_code=404)
+    trip = event_store.trip(session_id)
+    if trip is None:
+        return JSONResponse(content={"error": "no trip {!r}".format(session_id)}, status_code=404)
+    return trip
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
 # Main entry point (if needed for standalone server)
 if __name__ == "__main__":
     import uvicorn
@@ -10,6 +10,7 @@ import 'package:audioplayers/audioplayers.dart';
 import 'package:flutter/foundation.dart'; // For kIsWeb
 import 'package:camera/camera.dart'; // For mobile platforms
 import 'package:camera_web/camera_web.dart'; // For web platform
+import 'package:firebase_auth/firebase_auth.dart';
 
 class RealTimeFacialDetection extends StatefulWidget {
   const RealTimeFacialDetection({super.key});
@@ -25,6 +26,19 @@ class _RealTimeFacialDetectionState extends State<RealTimeFacialDetection> {
   AudioPlayer _audioPlayer = AudioPlayer();
   bool _isAlarmPlaying = false;
   final String _apiUrl = 'http://localhost:8000';
+  // Signed in user; the server keeps their calibrated thresholds across trips
+  final String? _driverId = FirebaseAuth.instance.currentUser?.uid;
+  // Keeps this trip's eye/mouth timers separate from other drivers on the server
+  late final String _sessionId =
+      '${_driverId ?? 'guest'}-${DateTime.now().millisecondsSinceEpoch}';
+  // Delay before the next frame; the server adjusts it with every response
+  // (next_frame_interval, in seconds)
+  Duration _frameInterval = Duration(milliseconds: 500);
+  Timer? _frameTimer;
+  // Region of the frame around the driver's face to send instead of the
+  // whole frame (crop_box, [left, top, right, bottom]); null when the
+  // server wants a full frame
+  List<int>? _cropBox;
 
   @override
   void initState() {
@@ -32,13 +46,20 @@ class _RealTimeFacialDetectionState extends State<RealTimeFacialDetection> {
     initializeCamera();
   }
 
-  Future<Map<String, dynamic>?> _sendImageToBackend(
-      Uint8List imageBytes) async {
+  Future<Map<String, dynamic>?> _sendImageToBackend(Uint8List imageBytes,
+      {List<int>? cropBox}) async {
     try {
       final request =
           http.MultipartRequest('POST', Uri.parse('$_apiUrl/detect_drowsiness'))
+            ..fields['session_id'] = _sessionId
             ..files.add(http.MultipartFile.fromBytes('file', imageBytes,
                 filename: 'frame.jpg'));
+      if (_driverId != null) {
+        request.fields['driver_id'] = _driverId!;
+      }
+      if (cropBox != null) {
+        request.fields['crop_box'] = cropBox.join(',');
+      }
 
       // debugPrint('Sending request to $_apiUrl...');
       final response = await request.send();
@@ -166,26 +187,58 @@ class _RealTimeFacialDetectionState extends State<RealTimeFacialDetection> {
       canvas.width = videoElement.videoWidth;
       canvas.height = videoElement.videoHeight;
       final ctx = canvas.getContext('2d') as html.CanvasRenderingContext2D;
+      final html.CanvasElement cropCanvas = html.CanvasElement();
+      final cropCtx =
+          cropCanvas.getContext('2d') as html.CanvasRenderingContext2D;
 
-      Timer.periodic(Duration(milliseconds: 500), (timer) async {
+      Future<void> sendFrame() async {
+        if (!mounted) {
+          return;
+        }
         if (_isDetecting ||
             videoElement.videoWidth == 0 ||
             videoElement.videoHeight == 0) {
+          _frameTimer = Timer(_frameInterval, sendFrame);
           return;
         }
 
         _isDetecting = true;
         try {
-          ctx.drawImage(videoElement, 0, 0);
-
-          final blob = await canvas.toBlob('image/jpeg');
+          final cropBox = _cropBox;
+          html.Blob? blob;
+          if (cropBox != null) {
+            // Send only the face region the server asked for
+            final width = cropBox[2] - cropBox[0];
+            final height = cropBox[3] - cropBox[1];
+            cropCanvas.width = width;
+            cropCanvas.height = height;
+            cropCtx.drawImageScaledFromSource(videoElement, cropBox[0],
+                cropBox[1], width, height, 0, 0, width, height);
+            blob = await cropCanvas.toBlob('image/jpeg');
+          } else {
+            ctx.drawImage(videoElement, 0, 0);
+            blob = await canvas.toBlob('image/jpeg');
+          }
 
           if (blob != null) {
             final imageBytes = await _convertBlobToUint8List(blob);
 
-            final result = await _sendImageToBackend(imageBytes);
+            final result =
+                await _sendImageToBackend(imageBytes, cropBox: cropBox);
+            if (result == null) {
+              _cropBox = null; // Start over from a full frame
+            }
 
             if (result != null) {
+              final interval = result['next_frame_interval'];
+              if (interval is num) {
+                _frameInterval =
+                    Duration(milliseconds: (interval * 1000).round());
+              }
+              final nextCrop = result['crop_box'];
+              _cropBox = nextCrop is List
+                  ? nextCrop.map((v) => (v as num).toInt()).toList()
+                  : null;
               // if (result['mouth_open'] == true &&
               //     result['eyes_closed'] == false) {
               //   debugPrint('Mouth open!');
@@ -211,11 +264,23 @@ class _RealTimeFacialDetectionState extends State<RealTimeFacialDetection> {
           debugPrint('Error: $e');
         } finally {
           _isDetecting = false;
+          if (mounted) {
+            _frameTimer = Timer(_frameInterval, sendFrame);
+          }
         }
-      });
+      }
+
+      sendFrame();
     });
   }
 
+  @override
+  void dispose() {
+    _frameTimer?.cancel();
+    _cameraController?.dispose();
+    super.dispose();
+  }
+
   @override
   Widget build(BuildContext context) {
     return Scaffold(